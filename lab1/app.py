@@ -1,9 +1,19 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, File, HTTPException, Request, UploadFile, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
+from fastapi.responses import FileResponse, Response
+from pydantic import BaseModel, Field
+from PIL import Image, ImageOps
+from typing import Literal
+import base64
+from collections import OrderedDict
+import asyncio
 import colorsys
+import hashlib
+import io
+import json
 import math
+import time
+import numpy as np
 
 app = FastAPI(title="Color Models Converter")
 
@@ -30,6 +40,39 @@ class HLSColor(BaseModel):
     s: float  # Saturation (0-100)
 
 
+class XYZColor(BaseModel):
+    """Модель CIE XYZ цвета (D65, Y белого = 100)"""
+    x: float  # X (0-95.047)
+    y: float  # Y (0-100)
+    z: float  # Z (0-108.883)
+
+
+class LabColor(BaseModel):
+    """Модель CIE L*a*b* цвета (D65)"""
+    l: float  # Lightness (0-100)
+    a: float  # Зеленый - красный (примерно -128..127)
+    b: float  # Синий - желтый (примерно -128..127)
+
+
+class PaletteRequest(BaseModel):
+    """Палитра для поиска ближайших цветов"""
+    colors: list[RGBColor] = Field(..., min_length=1, max_length=4096)
+
+
+class ExtractParams(BaseModel):
+    """Параметры извлечения палитры из изображения"""
+    n_colors: int = Field(8, ge=1, le=64, description="Число цветов палитры")
+    method: Literal["median_cut", "kmeans"] = "kmeans"
+    sample_size: int = Field(50_000, ge=1_000, le=500_000, description="Размер выборки пикселей")
+    remap: bool = Field(False, description="Вернуть изображение, перекрашенное в палитру")
+    seed: int = 0
+
+
+class NearestRequest(BaseModel):
+    """Набор цветов [r, g, b] для поиска ближайших цветов палитры"""
+    colors: list[tuple[int, int, int]] = Field(..., min_length=1)
+
+
 def cmyk_to_rgb(c: float, m: float, y: float, k: float) -> tuple[int, int, int]:
     """
     Преобразование CMYK в RGB
@@ -140,6 +183,448 @@ def hls_to_rgb(h: float, l: float, s: float) -> tuple[int, int, int]:
     return r, g, b
 
 
+# ============= CIE XYZ И L*a*b* =============
+
+# Матрица sRGB (линейный) -> XYZ для белой точки D65
+RGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+])
+XYZ_TO_RGB = np.linalg.inv(RGB_TO_XYZ)
+
+# Белая точка D65 (Y = 100)
+WHITE_D65 = np.array([95.047, 100.0, 108.883])
+
+LAB_DELTA = 6 / 29
+
+
+def srgb_to_linear(values: np.ndarray) -> np.ndarray:
+    """Гамма-декодирование sRGB: значения 0-1 -> линейная яркость 0-1"""
+    return np.where(values <= 0.04045, values / 12.92, ((values + 0.055) / 1.055) ** 2.4)
+
+
+def linear_to_srgb(values: np.ndarray) -> np.ndarray:
+    """Гамма-кодирование sRGB: линейная яркость 0-1 -> значения 0-1"""
+    values = np.clip(values, 0.0, 1.0)
+    return np.where(values <= 0.0031308, values * 12.92, 1.055 * values ** (1 / 2.4) - 0.055)
+
+
+# Линейная яркость для каждого 8-битного уровня (для массивов uint8)
+SRGB_TO_LINEAR_LUT = srgb_to_linear(np.arange(256) / 255.0)
+
+
+def rgb_to_xyz(rgb: np.ndarray) -> np.ndarray:
+    """
+    Преобразование RGB (0-255) в CIE XYZ
+
+    rgb - массив формы (..., 3); для uint8 гамма-декодирование
+    выполняется по таблице из 256 значений.
+
+    Формулы:
+    C_lin = C/12.92 при C <= 0.04045, иначе ((C + 0.055)/1.055)^2.4
+    [X, Y, Z] = 100 × M × [R_lin, G_lin, B_lin]
+    """
+    rgb = np.asarray(rgb)
+    if rgb.dtype == np.uint8:
+        linear = SRGB_TO_LINEAR_LUT[rgb]
+    else:
+        linear = srgb_to_linear(rgb / 255.0)
+    return linear @ (RGB_TO_XYZ.T * 100.0)
+
+
+def xyz_to_rgb(xyz: np.ndarray) -> np.ndarray:
+    """
+    Преобразование CIE XYZ в RGB (0-255, с округлением)
+
+    Цвета вне охвата sRGB обрезаются до ближайших допустимых значений.
+    """
+    linear = (np.asarray(xyz, dtype=np.float64) / 100.0) @ XYZ_TO_RGB.T
+    return np.rint(linear_to_srgb(linear) * 255).astype(np.int64)
+
+
+def xyz_to_lab(xyz: np.ndarray) -> np.ndarray:
+    """
+    Преобразование CIE XYZ в CIE L*a*b*
+
+    Формулы (Xn, Yn, Zn - белая точка D65):
+    f(t) = t^(1/3) при t > (6/29)^3, иначе t / (3 × (6/29)^2) + 4/29
+    L = 116 × f(Y/Yn) - 16
+    a = 500 × (f(X/Xn) - f(Y/Yn))
+    b = 200 × (f(Y/Yn) - f(Z/Zn))
+    """
+    t = np.asarray(xyz) / WHITE_D65
+    f = np.where(t > LAB_DELTA ** 3, np.cbrt(t), t / (3 * LAB_DELTA ** 2) + 4 / 29)
+    return np.stack([
+        116 * f[..., 1] - 16,
+        500 * (f[..., 0] - f[..., 1]),
+        200 * (f[..., 1] - f[..., 2]),
+    ], axis=-1)
+
+
+def lab_to_xyz(lab: np.ndarray) -> np.ndarray:
+    """
+    Преобразование CIE L*a*b* в CIE XYZ
+
+    f^-1(t) = t^3 при t > 6/29, иначе 3 × (6/29)^2 × (t - 4/29)
+    """
+    lab = np.asarray(lab, dtype=np.float64)
+    fy = (lab[..., 0] + 16) / 116
+    f = np.stack([fy + lab[..., 1] / 500, fy, fy - lab[..., 2] / 200], axis=-1)
+    t = np.where(f > LAB_DELTA, f ** 3, 3 * LAB_DELTA ** 2 * (f - 4 / 29))
+    return t * WHITE_D65
+
+
+def rgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """Преобразование RGB (0-255) в CIE L*a*b* через XYZ"""
+    return xyz_to_lab(rgb_to_xyz(rgb))
+
+
+def lab_to_rgb(lab: np.ndarray) -> np.ndarray:
+    """Преобразование CIE L*a*b* в RGB (0-255) через XYZ"""
+    return xyz_to_rgb(lab_to_xyz(lab))
+
+
+def perceptual_models(r: int, g: int, b: int) -> dict:
+    """XYZ и Lab для ответа конвертера"""
+    xyz = rgb_to_xyz(np.array([r, g, b], dtype=np.float64))
+    lab = xyz_to_lab(xyz)
+    return {
+        "xyz": {"x": round(float(xyz[0]), 2), "y": round(float(xyz[1]), 2), "z": round(float(xyz[2]), 2)},
+        "lab": {"l": round(float(lab[0]), 2), "a": round(float(lab[1]), 2), "b": round(float(lab[2]), 2)}
+    }
+
+
+# ============= ПОИСК БЛИЖАЙШЕГО ЦВЕТА ПАЛИТРЫ =============
+
+class PaletteIndex:
+    """
+    Индекс палитры для поиска ближайшего цвета в пространстве L*a*b*
+
+    Область цветов sRGB в Lab разбивается на сетку ячеек. Для каждой ячейки
+    заранее отбираются цвета палитры, которые могут быть ближайшими хотя бы
+    для одной точки ячейки: минимальное расстояние от ячейки до цвета не
+    больше наименьшего из максимальных расстояний до остальных цветов.
+    Запросы группируются по ячейкам, и каждая группа сравнивается только
+    со своими кандидатами (обычно единицы цветов), а не со всей палитрой.
+    Результат точный (расстояние - CIE76, евклидово в Lab).
+
+    Повторяющиеся цвета (пиксели изображения) ищутся один раз.
+    """
+
+    # Границы охвата sRGB в Lab (с небольшим запасом)
+    LAB_MIN = np.array([0.0, -87.0, -108.0])
+    LAB_MAX = np.array([100.01, 99.0, 95.0])
+
+    def __init__(self, rgb: np.ndarray, grid: int = 24):
+        self.rgb = np.asarray(rgb, dtype=np.uint8).reshape(-1, 3)
+        self.lab = rgb_to_lab(self.rgb).astype(np.float32)
+        self.grid = grid
+        self.step = (self.LAB_MAX - self.LAB_MIN) / grid
+        self.offsets, self.members = self._build_candidates()
+
+    def _build_candidates(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Кандидаты ячеек в сжатом виде: members[offsets[c]:offsets[c + 1]]
+
+        Квадраты расстояний раскладываются по осям, поэтому для каждой оси
+        считается таблица (ячейка оси, цвет), а полная - их суммой.
+        """
+        near, far = [], []
+        for i in range(3):
+            lo = (np.arange(self.grid) * self.step[i] + self.LAB_MIN[i])[:, None]
+            hi = lo + self.step[i]
+            p = self.lab[:, i].astype(np.float64)[None, :]
+            near.append((np.maximum(np.maximum(lo - p, p - hi), 0.0) ** 2).astype(np.float32))
+            far.append((np.maximum(np.abs(p - lo), np.abs(p - hi)) ** 2).astype(np.float32))
+
+        masks = []
+        for x in range(self.grid):
+            d_min = near[0][x] + near[1][:, None, :] + near[2][None, :, :]
+            d_max = far[0][x] + far[1][:, None, :] + far[2][None, :, :]
+            masks.append(d_min <= d_max.min(axis=-1, keepdims=True) * (1 + 1e-5))
+        mask = np.stack(masks).reshape(self.grid ** 3, len(self.lab))
+
+        offsets = np.zeros(len(mask) + 1, dtype=np.int64)
+        np.cumsum(mask.sum(axis=1), out=offsets[1:])
+        return offsets, np.nonzero(mask)[1].astype(np.int32)
+
+    @property
+    def mean_candidates(self) -> float:
+        return len(self.members) / (len(self.offsets) - 1)
+
+    def nearest_lab(self, lab: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Индексы ближайших цветов палитры и расстояния (Delta E 76)"""
+        lab = np.asarray(lab, dtype=np.float32).reshape(-1, 3)
+        indices = np.empty(len(lab), dtype=np.int32)
+        distances = np.empty(len(lab), dtype=np.float32)
+
+        cell = np.floor((lab - self.LAB_MIN) / self.step).astype(np.int64)
+        inside = np.all((cell >= 0) & (cell < self.grid), axis=1)
+        flat = (cell[:, 0] * self.grid + cell[:, 1]) * self.grid + cell[:, 2]
+
+        # Группировка запросов по ячейкам (если ни одна точка не попала
+        # в сетку, групп нет - пустой rows дал бы пару границ (0, 0))
+        rows = np.flatnonzero(inside)
+        rows = rows[np.argsort(flat[rows], kind="stable")]
+        cells = flat[rows]
+        bounds = np.flatnonzero(np.diff(cells)) + 1
+        starts = np.r_[0, bounds] if len(rows) else np.empty(0, dtype=np.int64)
+        for start, end in zip(starts, np.r_[bounds, len(rows)]):
+            c = cells[start]
+            cand = self.members[self.offsets[c]:self.offsets[c + 1]]
+            group = rows[start:end]
+            d2 = ((lab[group, None, :] - self.lab[cand][None, :, :]) ** 2).sum(axis=-1)
+            best = d2.argmin(axis=1)
+            indices[group] = cand[best]
+            distances[group] = d2[np.arange(len(group)), best]
+
+        # Точки вне охвата sRGB (только при запросах в Lab) - полный перебор
+        outside = np.flatnonzero(~inside)
+        step = max(1, (1 << 22) // len(self.lab))
+        for start in range(0, len(outside), step):
+            group = outside[start:start + step]
+            d2 = ((lab[group, None, :] - self.lab[None, :, :]) ** 2).sum(axis=-1)
+            indices[group] = d2.argmin(axis=1)
+            distances[group] = d2.min(axis=1)
+
+        return indices, np.sqrt(distances)
+
+    def nearest_rgb(self, rgb: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Ближайшие цвета палитры для массива RGB (N, 3)
+
+        Для больших наборов уникальные цвета находятся по маске на все
+        2^24 значения, поиск выполняется только для них.
+        """
+        rgb = np.asarray(rgb, dtype=np.uint8).reshape(-1, 3)
+        if len(rgb) <= 1 << 16:
+            return self.nearest_lab(rgb_to_lab(rgb))
+
+        packed = (rgb[:, 0].astype(np.uint32) << 16) | (rgb[:, 1].astype(np.uint32) << 8) | rgb[:, 2]
+        present = np.zeros(1 << 24, dtype=bool)
+        present[packed] = True
+        unique = np.flatnonzero(present).astype(np.uint32)
+        unique_rgb = np.stack([unique >> 16, (unique >> 8) & 255, unique & 255], axis=1).astype(np.uint8)
+
+        idx, dist = self.nearest_lab(rgb_to_lab(unique_rgb))
+        # Таблица цвет -> результат только для встретившихся цветов
+        position = np.zeros(1 << 24, dtype=np.int32)
+        position[unique] = np.arange(len(unique), dtype=np.int32)
+        where = position[packed]
+        return idx[where], dist[where]
+
+
+PALETTE_CACHE_SIZE = 32
+
+# palette_id -> PaletteIndex; самые старые вытесняются
+_palettes: "OrderedDict[str, PaletteIndex]" = OrderedDict()
+
+
+def palette_id_for(rgb: np.ndarray) -> str:
+    """Идентификатор палитры - хэш ее цветов (одинаковые палитры - один индекс)"""
+    return hashlib.blake2b(np.ascontiguousarray(rgb, dtype=np.uint8).tobytes(), digest_size=12).hexdigest()
+
+
+def register_palette(rgb: np.ndarray) -> tuple[str, PaletteIndex, bool]:
+    """Построение индекса палитры (или взятие из кэша): (id, индекс, создан ли заново)"""
+    palette_id = palette_id_for(rgb)
+    index = _palettes.get(palette_id)
+    created = index is None
+    if created:
+        index = PaletteIndex(rgb)
+        _palettes[palette_id] = index
+        while len(_palettes) > PALETTE_CACHE_SIZE:
+            _palettes.popitem(last=False)
+    _palettes.move_to_end(palette_id)
+    return palette_id, index, created
+
+
+def get_palette(palette_id: str) -> PaletteIndex:
+    index = _palettes.get(palette_id)
+    if index is None:
+        raise HTTPException(status_code=404, detail="Palette not found")
+    _palettes.move_to_end(palette_id)
+    return index
+
+
+def check_rgb_range(rgb: np.ndarray):
+    if rgb.size and (rgb.min() < 0 or rgb.max() > 255):
+        raise HTTPException(status_code=400, detail="RGB values must be in 0..255")
+
+
+def all_models(r: int, g: int, b: int) -> dict:
+    """Цвет во всех моделях конвертера (по RGB)"""
+    c, m, y, k = rgb_to_cmyk(r, g, b)
+    h, l, s = rgb_to_hls(r, g, b)
+    return {
+        "hex": f"#{r:02X}{g:02X}{b:02X}",
+        "cmyk": {"c": round(c, 2), "m": round(m, 2), "y": round(y, 2), "k": round(k, 2)},
+        "rgb": {"r": r, "g": g, "b": b},
+        "hls": {"h": round(h, 2), "l": round(l, 2), "s": round(s, 2)},
+        **perceptual_models(r, g, b)
+    }
+
+
+# ============= ИЗВЛЕЧЕНИЕ ПАЛИТРЫ =============
+
+# Размер, до которого JPEG уменьшается при декодировании, если перекраска не нужна
+EXTRACT_DECODE_DIM = 1024
+
+
+def median_cut(pixels: np.ndarray, n_colors: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Палитра методом медианного сечения (median cut)
+
+    Все пиксели помещаются в один параллелепипед RGB. На каждом шаге
+    выбирается параллелепипед с наибольшим (размах × число пикселей)
+    и делится по медиане вдоль самой длинной оси. Цвет палитры -
+    среднее пикселей параллелепипеда.
+
+    Возвращает цвета (float32, RGB) и число пикселей каждого.
+    """
+    boxes = [pixels]
+    while len(boxes) < n_colors:
+        scores = [int(np.ptp(box, axis=0).max()) * len(box) for box in boxes]
+        i = int(np.argmax(scores))
+        if scores[i] == 0:
+            break
+        box = boxes.pop(i)
+        axis = int(np.argmax(np.ptp(box, axis=0)))
+        half = len(box) // 2
+        order = np.argpartition(box[:, axis], half)
+        boxes += [box[order[:half]], box[order[half:]]]
+
+    centers = np.array([box.mean(axis=0) for box in boxes], dtype=np.float32)
+    counts = np.array([len(box) for box in boxes])
+    return centers, counts
+
+
+def nearest_centers(points: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    """Номер ближайшего центра: |x|^2 - 2 x·c + |c|^2 (одно матричное умножение)"""
+    d2 = (centers ** 2).sum(axis=1)[None, :] - 2 * points @ centers.T
+    return d2.argmin(axis=1)
+
+
+def minibatch_kmeans(points: np.ndarray, centers: np.ndarray, rng: np.random.Generator,
+                     batch_size: int = 2048, max_iter: int = 100,
+                     tol: float = 0.05) -> tuple[np.ndarray, np.ndarray, int]:
+    """
+    Мини-пакетный k-means (Sculley, 2010)
+
+    На каждой итерации случайный пакет точек приписывается к ближайшим
+    центрам, и каждый центр сдвигается к среднему своих точек с шагом
+    1 / (число точек, учтенных центром). Остановка, когда центры
+    смещаются меньше чем на tol (в единицах Delta E).
+
+    Возвращает центры, число точек выборки у каждого и число итераций.
+    """
+    k = len(centers)
+    centers = centers.astype(np.float32).copy()
+    seen = np.zeros(k, dtype=np.float32)
+
+    iteration = 0
+    for iteration in range(1, max_iter + 1):
+        batch = points[rng.integers(0, len(points), batch_size)]
+        labels = nearest_centers(batch, centers)
+        counts = np.bincount(labels, minlength=k).astype(np.float32)
+        sums = np.stack([np.bincount(labels, weights=batch[:, i], minlength=k) for i in range(3)], axis=1)
+
+        updated = counts > 0
+        seen += counts
+        previous = centers.copy()
+        centers[updated] += (sums[updated] - counts[updated, None] * centers[updated]) / seen[updated, None]
+        if np.sqrt(((centers - previous) ** 2).sum(axis=1)).max() < tol:
+            break
+
+    counts = np.bincount(nearest_centers(points, centers), minlength=k)
+    return centers, counts, iteration
+
+
+def load_image_for_palette(stream, max_dim: int = None) -> np.ndarray:
+    """
+    Декодирование изображения в массив RGB
+
+    При max_dim JPEG декодируется сразу в уменьшенном размере (draft),
+    что во много раз быстрее полного декодирования.
+    """
+    try:
+        image = Image.open(stream)
+        if max_dim is not None:
+            image.draft("RGB", (max_dim, max_dim))
+        image = ImageOps.exif_transpose(image)
+        return np.asarray(image.convert("RGB"))
+    except (OSError, Image.DecompressionBombError) as e:
+        raise HTTPException(status_code=400, detail=f"Cannot read image: {e}")
+
+
+# ============= ПОТОКОВАЯ КОНВЕРТАЦИЯ (WEBSOCKET) =============
+
+# Число значений в сообщении для каждой исходной модели
+STREAM_MODELS = {"cmyk": 4, "rgb": 3, "hls": 3, "xyz": 3, "lab": 3}
+
+
+def convert_compact(model: str, values: list) -> list:
+    """
+    Конвертация одного цвета в компактный ответ
+
+    Порядок: c, m, y, k, r, g, b, h, l, s, x, y, z, L, a, b.
+    Значения исходной модели возвращаются как есть, остальные
+    считаются теми же функциями, что и в /convert/*_to_all.
+    """
+    xyz = lab = None
+    if model == "cmyk":
+        r, g, b = cmyk_to_rgb(*values)
+    elif model == "rgb":
+        r, g, b = (int(v) for v in values)
+        if not all(0 <= v <= 255 for v in (r, g, b)):
+            raise ValueError("RGB values must be in 0..255")
+    elif model == "hls":
+        r, g, b = hls_to_rgb(*values)
+    elif model == "xyz":
+        xyz = np.array(values, dtype=np.float64)
+        r, g, b = (int(v) for v in xyz_to_rgb(xyz))
+    else:
+        lab = np.array(values, dtype=np.float64)
+        xyz = lab_to_xyz(lab)
+        r, g, b = (int(v) for v in xyz_to_rgb(xyz))
+
+    cmyk = values if model == "cmyk" else [round(v, 2) for v in rgb_to_cmyk(r, g, b)]
+    hls = values if model == "hls" else [round(v, 2) for v in rgb_to_hls(r, g, b)]
+    if xyz is None:
+        xyz = rgb_to_xyz(np.array([r, g, b], dtype=np.float64))
+    if lab is None:
+        lab = xyz_to_lab(xyz)
+    xyz_out = values if model == "xyz" else [round(float(v), 2) for v in xyz]
+    lab_out = values if model == "lab" else [round(float(v), 2) for v in lab]
+    return [*cmyk, r, g, b, *hls, *xyz_out, *lab_out]
+
+
+def handle_stream_message(text: str) -> str:
+    """
+    Разбор сообщения [seq, model, v1, v2, ...] и формирование ответа [seq, ...]
+
+    json.loads принимает Infinity, NaN и 1e400, поэтому значения
+    проверяются на конечность: любая ошибка дает ответ [seq, "error", ...],
+    а не обрыв соединения и не NaN в ответе.
+    """
+    seq = None
+    try:
+        message = json.loads(text)
+        seq, model, values = message[0], message[1], message[2:]
+        if model not in STREAM_MODELS or len(values) != STREAM_MODELS[model]:
+            raise ValueError(f"Expected [seq, model, values...] with model in {list(STREAM_MODELS)}")
+        if not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+            raise ValueError("Values must be numbers")
+        if not all(math.isfinite(v) for v in values):
+            raise ValueError("Values must be finite")
+        return json.dumps([seq, *convert_compact(model, values)], separators=(",", ":"), allow_nan=False)
+    except (ValueError, TypeError, IndexError, KeyError, OverflowError) as e:
+        if isinstance(seq, float) and not math.isfinite(seq):
+            seq = None
+        return json.dumps([seq, "error", str(e)], separators=(",", ":"))
+
+
 @app.get("/")
 async def read_root():
     """Главная страница приложения"""
@@ -160,7 +645,8 @@ async def convert_cmyk_to_all(color: CMYKColor):
     return {
         "cmyk": {"c": color.c, "m": color.m, "y": color.y, "k": color.k},
         "rgb": {"r": r, "g": g, "b": b},
-        "hls": {"h": round(h, 2), "l": round(l, 2), "s": round(s, 2)}
+        "hls": {"h": round(h, 2), "l": round(l, 2), "s": round(s, 2)},
+        **perceptual_models(r, g, b)
     }
 
 
@@ -178,7 +664,8 @@ async def convert_rgb_to_all(color: RGBColor):
     return {
         "cmyk": {"c": round(c, 2), "m": round(m, 2), "y": round(y, 2), "k": round(k, 2)},
         "rgb": {"r": color.r, "g": color.g, "b": color.b},
-        "hls": {"h": round(h, 2), "l": round(l, 2), "s": round(s, 2)}
+        "hls": {"h": round(h, 2), "l": round(l, 2), "s": round(s, 2)},
+        **perceptual_models(color.r, color.g, color.b)
     }
 
 
@@ -196,10 +683,308 @@ async def convert_hls_to_all(color: HLSColor):
     return {
         "cmyk": {"c": round(c, 2), "m": round(m, 2), "y": round(y, 2), "k": round(k, 2)},
         "rgb": {"r": r, "g": g, "b": b},
-        "hls": {"h": color.h, "l": color.l, "s": color.s}
+        "hls": {"h": color.h, "l": color.l, "s": color.s},
+        **perceptual_models(r, g, b)
+    }
+
+
+@app.post("/convert/xyz_to_all")
+async def convert_xyz_to_all(color: XYZColor):
+    """
+    Преобразование CIE XYZ во все остальные модели
+    """
+    # XYZ -> RGB
+    r, g, b = (int(v) for v in xyz_to_rgb([color.x, color.y, color.z]))
+    
+    # RGB -> CMYK, HLS
+    c, m, y, k = rgb_to_cmyk(r, g, b)
+    h, l, s = rgb_to_hls(r, g, b)
+    lab = xyz_to_lab(np.array([color.x, color.y, color.z]))
+    
+    return {
+        "cmyk": {"c": round(c, 2), "m": round(m, 2), "y": round(y, 2), "k": round(k, 2)},
+        "rgb": {"r": r, "g": g, "b": b},
+        "hls": {"h": round(h, 2), "l": round(l, 2), "s": round(s, 2)},
+        "xyz": {"x": color.x, "y": color.y, "z": color.z},
+        "lab": {"l": round(float(lab[0]), 2), "a": round(float(lab[1]), 2), "b": round(float(lab[2]), 2)}
+    }
+
+
+@app.post("/convert/lab_to_all")
+async def convert_lab_to_all(color: LabColor):
+    """
+    Преобразование CIE L*a*b* во все остальные модели
+    """
+    # Lab -> XYZ -> RGB
+    xyz = lab_to_xyz([color.l, color.a, color.b])
+    r, g, b = (int(v) for v in xyz_to_rgb(xyz))
+    
+    # RGB -> CMYK, HLS
+    c, m, y, k = rgb_to_cmyk(r, g, b)
+    h, l, s = rgb_to_hls(r, g, b)
+    
+    return {
+        "cmyk": {"c": round(c, 2), "m": round(m, 2), "y": round(y, 2), "k": round(k, 2)},
+        "rgb": {"r": r, "g": g, "b": b},
+        "hls": {"h": round(h, 2), "l": round(l, 2), "s": round(s, 2)},
+        "xyz": {"x": round(float(xyz[0]), 2), "y": round(float(xyz[1]), 2), "z": round(float(xyz[2]), 2)},
+        "lab": {"l": color.l, "a": color.a, "b": color.b}
+    }
+
+
+@app.post("/palette")
+async def create_palette(palette: PaletteRequest):
+    """
+    Регистрация палитры для поиска ближайших цветов
+
+    Индекс строится один раз и кэшируется по идентификатору палитры.
+    """
+    rgb = np.array([[c.r, c.g, c.b] for c in palette.colors])
+    check_rgb_range(rgb)
+    
+    start = time.perf_counter()
+    palette_id, index, created = register_palette(rgb)
+    build_ms = (time.perf_counter() - start) * 1000
+    
+    return {
+        "palette_id": palette_id,
+        "size": len(index.rgb),
+        "mean_candidates": round(index.mean_candidates, 2),
+        "cached": not created,
+        "build_ms": round(build_ms, 2),
+        "colors": [
+            {
+                "rgb": {"r": int(r), "g": int(g), "b": int(b)},
+                "lab": {"l": round(float(lab[0]), 2), "a": round(float(lab[1]), 2), "b": round(float(lab[2]), 2)}
+            }
+            for (r, g, b), lab in zip(index.rgb, index.lab)
+        ]
     }
 
 
+@app.post("/palette/extract")
+async def extract_palette(
+    file: UploadFile = File(...),
+    n_colors: int = 8,
+    method: str = "kmeans",
+    sample_size: int = 50_000,
+    remap: bool = False,
+    seed: int = 0
+):
+    """
+    Извлечение доминирующих цветов изображения
+
+    Методы:
+    - median_cut: медианное сечение в RGB
+    - kmeans: мини-пакетный k-means в Lab, начальные центры - median cut
+
+    Цвета считаются по случайной выборке пикселей (sample_size).
+    Каждый цвет возвращается во всех моделях конвертера вместе с долей
+    пикселей. Палитра регистрируется для поиска ближайших цветов;
+    при remap=true возвращается изображение, перекрашенное в палитру.
+    """
+    try:
+        params = ExtractParams(n_colors=n_colors, method=method, sample_size=sample_size,
+                               remap=remap, seed=seed)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    timings = {}
+    start = time.perf_counter()
+    image = load_image_for_palette(file.file, None if params.remap else EXTRACT_DECODE_DIM)
+    timings["decode_ms"] = (time.perf_counter() - start) * 1000
+    
+    # Выборка пикселей
+    start = time.perf_counter()
+    rng = np.random.default_rng(params.seed)
+    pixels = image.reshape(-1, 3)
+    if len(pixels) > params.sample_size:
+        pixels = pixels[rng.integers(0, len(pixels), params.sample_size)]
+    timings["sample_ms"] = (time.perf_counter() - start) * 1000
+    
+    start = time.perf_counter()
+    centers, counts = median_cut(pixels, params.n_colors)
+    iterations = 0
+    if params.method == "kmeans":
+        lab_centers, counts, iterations = minibatch_kmeans(
+            rgb_to_lab(pixels).astype(np.float32), rgb_to_lab(centers).astype(np.float32), rng
+        )
+        palette = lab_to_rgb(lab_centers)
+    else:
+        palette = np.rint(centers).astype(np.int64)
+    timings["cluster_ms"] = (time.perf_counter() - start) * 1000
+    
+    # Совпавшие после округления цвета объединяются, пустые - отбрасываются
+    keys = (palette[:, 0] << 16) | (palette[:, 1] << 8) | palette[:, 2]
+    keys, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inverse.ravel(), weights=counts).astype(np.int64)
+    order = np.argsort(-counts, kind="stable")
+    order = order[counts[order] > 0]
+    keys, counts = keys[order], counts[order]
+    palette = np.stack([keys >> 16, (keys >> 8) & 255, keys & 255], axis=1)
+    
+    palette_id, index, _ = register_palette(palette.astype(np.uint8))
+    
+    response = {
+        "palette_id": palette_id,
+        "method": params.method,
+        "iterations": iterations,
+        "width": image.shape[1],
+        "height": image.shape[0],
+        "sample_size": len(pixels),
+        "colors": [
+            {**all_models(int(r), int(g), int(b)), "share": round(float(n) / counts.sum(), 4)}
+            for (r, g, b), n in zip(palette, counts)
+        ]
+    }
+    
+    if params.remap:
+        start = time.perf_counter()
+        indices, _ = index.nearest_rgb(image.reshape(-1, 3))
+        # Изображение с палитрой (режим P) кодируется в PNG быстрее и компактнее
+        mapped = Image.fromarray(indices.astype(np.uint8).reshape(image.shape[:2]), mode="P")
+        mapped.putpalette(index.rgb.ravel().tolist())
+        buff = io.BytesIO()
+        mapped.save(buff, format="PNG", compress_level=1)
+        response["remapped"] = "data:image/png;base64," + base64.b64encode(buff.getvalue()).decode()
+        timings["remap_ms"] = (time.perf_counter() - start) * 1000
+    
+    response["timings"] = {key: round(value, 2) for key, value in timings.items()}
+    return response
+
+
+@app.post("/palette/{palette_id}/nearest")
+async def nearest_palette_colors(palette_id: str, request: NearestRequest):
+    """
+    Ближайшие цвета палитры для набора цветов [r, g, b]
+
+    Возвращает индексы цветов палитры и расстояния Delta E (CIE76).
+    """
+    index = get_palette(palette_id)
+    rgb = np.array(request.colors)
+    check_rgb_range(rgb)
+    
+    start = time.perf_counter()
+    indices, distances = index.nearest_rgb(rgb.astype(np.uint8))
+    
+    return {
+        "palette_id": palette_id,
+        "indices": indices.tolist(),
+        "distances": np.round(distances.astype(np.float64), 2).tolist(),
+        "time_ms": round((time.perf_counter() - start) * 1000, 2)
+    }
+
+
+@app.post("/palette/{palette_id}/nearest/raw")
+async def nearest_palette_colors_raw(palette_id: str, request: Request):
+    """
+    Ближайшие цвета палитры для больших наборов (без JSON)
+
+    Тело запроса - байты R, G, B подряд. Ответ - индексы цветов палитры:
+    по байту на цвет (палитра до 256 цветов) или uint16 little-endian.
+    """
+    index = get_palette(palette_id)
+    body = await request.body()
+    if not body:
+        raise HTTPException(status_code=400, detail="Empty body")
+    if len(body) % 3:
+        raise HTTPException(status_code=400, detail="Body length must be a multiple of 3")
+    
+    start = time.perf_counter()
+    indices, _ = index.nearest_rgb(np.frombuffer(body, dtype=np.uint8))
+    dtype = np.uint8 if len(index.rgb) <= 256 else np.dtype("<u2")
+    
+    return Response(
+        content=indices.astype(dtype).tobytes(),
+        media_type="application/octet-stream",
+        headers={
+            "X-Index-Bytes": str(np.dtype(dtype).itemsize),
+            "X-Time-Ms": f"{(time.perf_counter() - start) * 1000:.2f}"
+        }
+    )
+
+
+@app.post("/palette/{palette_id}/map")
+async def map_image_to_palette(palette_id: str, file: UploadFile = File(...)):
+    """
+    Замена каждого пикселя изображения ближайшим цветом палитры (PNG)
+    """
+    index = get_palette(palette_id)
+    try:
+        image = np.asarray(Image.open(file.file).convert("RGB"))
+    except (OSError, Image.DecompressionBombError) as e:
+        raise HTTPException(status_code=400, detail=f"Cannot read image: {e}")
+    
+    start = time.perf_counter()
+    indices, _ = index.nearest_rgb(image.reshape(-1, 3))
+    mapped = index.rgb[indices].reshape(image.shape)
+    map_ms = (time.perf_counter() - start) * 1000
+    
+    buff = io.BytesIO()
+    Image.fromarray(mapped).save(buff, format="PNG")
+    return Response(
+        content=buff.getvalue(),
+        media_type="image/png",
+        headers={"X-Time-Ms": f"{map_ms:.2f}"}
+    )
+
+
+@app.websocket("/ws/convert")
+async def convert_stream(websocket: WebSocket):
+    """
+    Канал конвертации для живого выбора цвета
+
+    Одно соединение на страницу вместо HTTP-запроса на каждое движение
+    слайдера. Клиент шлет [seq, model, v1, v2, ...] (model: cmyk, rgb,
+    hls, xyz, lab), сервер отвечает [seq, c, m, y, k, r, g, b, h, l, s,
+    x, y, z, L, a, b] или [seq, "error", описание].
+
+    Сообщения, пришедшие пока шла обработка, схлопываются: конвертируется
+    только последнее, промежуточные значения отбрасываются.
+    """
+    await websocket.accept()
+    latest = None
+    closed = False
+    arrived = asyncio.Event()
+
+    async def receive():
+        nonlocal latest, closed
+        # receive() вместо receive_text(): бинарный кадр не должен ронять
+        # приемник, иначе обработчик навсегда остается ждать arrived
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("text") is not None:
+                    latest = message["text"]
+                elif message.get("bytes") is not None:
+                    latest = message["bytes"].decode("utf-8", errors="replace")
+                arrived.set()
+        finally:
+            closed = True
+            arrived.set()
+
+    receiver = asyncio.create_task(receive())
+    try:
+        while True:
+            await arrived.wait()
+            # Даем приемнику дочитать уже пришедшие сообщения:
+            # после пачки остается только последнее
+            while arrived.is_set():
+                arrived.clear()
+                await asyncio.sleep(0)
+            if closed:
+                break
+            message, latest = latest, None
+            if message is not None:
+                await websocket.send_text(handle_stream_message(message))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+
+
 # Монтируем статические файлы
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
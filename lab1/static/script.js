@@ -4,6 +4,7 @@ let currentModel = null;
 
 // Инициализация при загрузке страницы
 document.addEventListener('DOMContentLoaded', () => {
+    converter.connect();
     initializePalette();
     setupEventListeners();
     updateAllModels('rgb'); // Инициализация с белым цветом
@@ -72,6 +73,75 @@ function setupEventListeners() {
 
     // Кнопка копирования HEX
     document.getElementById('copyHex').addEventListener('click', copyHexToClipboard);
+
+    // Извлечение палитры из изображения
+    document.getElementById('extractPalette').addEventListener('click', extractPalette);
+}
+
+// Извлечение доминирующих цветов изображения
+async function extractPalette() {
+    const file = document.getElementById('paletteImage').files[0];
+    if (!file) {
+        alert('Сначала выберите изображение');
+        return;
+    }
+
+    const params = new URLSearchParams({
+        n_colors: document.getElementById('paletteSize').value,
+        method: document.getElementById('paletteMethod').value,
+        remap: document.getElementById('paletteRemap').checked
+    });
+    const formData = new FormData();
+    formData.append('file', file);
+
+    try {
+        const response = await fetch(`/palette/extract?${params}`, {
+            method: 'POST',
+            body: formData
+        });
+        if (!response.ok) throw new Error((await response.json()).detail);
+
+        const data = await response.json();
+        showExtractedPalette(data);
+    } catch (error) {
+        console.error('Ошибка при извлечении палитры:', error);
+        alert('Не удалось извлечь палитру: ' + error.message);
+    }
+}
+
+// Отображение палитры: клик по цвету выбирает его во всех моделях
+function showExtractedPalette(data) {
+    const palette = document.getElementById('extractedPalette');
+    palette.innerHTML = '';
+
+    data.colors.forEach(color => {
+        const item = document.createElement('div');
+        const colorDiv = document.createElement('div');
+        colorDiv.className = 'palette-color';
+        colorDiv.style.backgroundColor = color.hex;
+        colorDiv.title = `${color.hex} • CMYK ${color.cmyk.c}/${color.cmyk.m}/${color.cmyk.y}/${color.cmyk.k} • ` +
+            `HLS ${color.hls.h}/${color.hls.l}/${color.hls.s}`;
+        colorDiv.addEventListener('click', () => {
+            setRGBValues(color.rgb.r, color.rgb.g, color.rgb.b);
+            updateAllModels('rgb');
+        });
+
+        const share = document.createElement('span');
+        share.className = 'palette-share';
+        share.textContent = `${(color.share * 100).toFixed(1)}%`;
+
+        item.appendChild(colorDiv);
+        item.appendChild(share);
+        palette.appendChild(item);
+    });
+
+    const remapped = document.getElementById('remappedImage');
+    if (data.remapped) {
+        remapped.src = data.remapped;
+        remapped.style.display = 'block';
+    } else {
+        remapped.style.display = 'none';
+    }
 }
 
 // Связывание слайдера и числового поля
@@ -102,56 +172,135 @@ function setupSliderPair(sliderId, inputId, callback) {
     });
 }
 
-// Обновление всех моделей
-async function updateAllModels(sourceModel) {
-    if (isUpdating) return;
-    
-    isUpdating = true;
-    currentModel = sourceModel;
+// Поля каждой модели в порядке значений сообщения
+const MODEL_FIELDS = {
+    cmyk: ['c', 'm', 'y', 'k'],
+    rgb: ['r', 'g', 'b'],
+    hls: ['h', 'l', 's']
+};
 
-    try {
-        let response;
-
-        if (sourceModel === 'cmyk') {
-            const c = parseFloat(document.getElementById('cmyk-c').value);
-            const m = parseFloat(document.getElementById('cmyk-m').value);
-            const y = parseFloat(document.getElementById('cmyk-y').value);
-            const k = parseFloat(document.getElementById('cmyk-k').value);
-
-            response = await fetch('/convert/cmyk_to_all', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ c, m, y, k })
-            });
-        } else if (sourceModel === 'rgb') {
-            const r = parseInt(document.getElementById('rgb-r').value);
-            const g = parseInt(document.getElementById('rgb-g').value);
-            const b = parseInt(document.getElementById('rgb-b').value);
-
-            response = await fetch('/convert/rgb_to_all', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ r, g, b })
-            });
-        } else if (sourceModel === 'hls') {
-            const h = parseFloat(document.getElementById('hls-h').value);
-            const l = parseFloat(document.getElementById('hls-l').value);
-            const s = parseFloat(document.getElementById('hls-s').value);
-
-            response = await fetch('/convert/hls_to_all', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ h, l, s })
-            });
+// Канал конвертации через WebSocket: одно соединение на страницу,
+// не больше одного запроса в полете. Пока ждем ответ, сохраняется только
+// последнее значение - промежуточные положения слайдера не отправляются.
+const converter = {
+    socket: null,
+    seq: 0,
+    inFlight: null,
+    pending: null,
+
+    connect() {
+        const protocol = location.protocol === 'https:' ? 'wss:' : 'ws:';
+        const socket = new WebSocket(`${protocol}//${location.host}/ws/convert`);
+        socket.onmessage = (event) => this.onReply(JSON.parse(event.data));
+        socket.onclose = () => {
+            if (this.socket === socket) this.socket = null;
+            // Повторяем только запрос, отправленный через это соединение;
+            // HTTP-запрос в полете завершится сам
+            const lost = this.inFlight;
+            if (lost && lost.socket === socket) {
+                this.inFlight = null;
+                if (!this.pending) this.pending = lost;
+                this.flush();
+            }
+            setTimeout(() => this.connect(), 2000);
+        };
+        socket.onopen = () => {
+            this.socket = socket;
+            if (!this.inFlight) this.flush();
+        };
+    },
+
+    request(model, values) {
+        this.pending = { model, values };
+        if (!this.inFlight) this.flush();
+    },
+
+    flush() {
+        if (!this.pending) return;
+        const { model, values } = this.pending;
+        this.pending = null;
+        const seq = ++this.seq;
+
+        if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+            this.inFlight = { model, values, seq, socket: this.socket };
+            this.socket.send(JSON.stringify([seq, model, ...values]));
+        } else {
+            // Соединение еще не установлено или недоступно - обычный запрос
+            this.inFlight = { model, values, seq, socket: null };
+            convertOverHttp(model, values)
+                .then(data => this.onResult(seq, data))
+                .catch(error => {
+                    console.error('Ошибка при конвертации:', error);
+                    if (this.inFlight && this.inFlight.seq === seq) {
+                        this.inFlight = null;
+                        this.flush();
+                    }
+                });
         }
+    },
 
-        const data = await response.json();
-        updateUI(data, sourceModel);
-    } catch (error) {
-        console.error('Ошибка при конвертации:', error);
-    } finally {
-        isUpdating = false;
+    onReply(message) {
+        const seq = message[0];
+        if (message[1] === 'error') {
+            console.error('Ошибка при конвертации:', message[2]);
+            if (this.inFlight && this.inFlight.seq === seq) {
+                this.inFlight = null;
+                this.flush();
+            }
+            return;
+        }
+        const v = message.slice(1);
+        this.onResult(seq, {
+            cmyk: { c: v[0], m: v[1], y: v[2], k: v[3] },
+            rgb: { r: v[4], g: v[5], b: v[6] },
+            hls: { h: v[7], l: v[8], s: v[9] },
+            xyz: { x: v[10], y: v[11], z: v[12] },
+            lab: { l: v[13], a: v[14], b: v[15] }
+        });
+    },
+
+    onResult(seq, data) {
+        // Ответ не на текущий запрос (например, повторенный после обрыва) - игнорируем
+        if (!this.inFlight || this.inFlight.seq !== seq) return;
+        const { model } = this.inFlight;
+        this.inFlight = null;
+        // Если за время запроса пришло новое значение, этот ответ устарел
+        if (!this.pending) {
+            isUpdating = true;
+            try {
+                updateUI(data, model);
+            } finally {
+                isUpdating = false;
+            }
+        }
+        this.flush();
     }
+};
+
+// Конвертация одним HTTP-запросом (пока WebSocket недоступен)
+async function convertOverHttp(model, values) {
+    const body = {};
+    MODEL_FIELDS[model].forEach((field, i) => { body[field] = values[i]; });
+
+    const response = await fetch(`/convert/${model}_to_all`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(body)
+    });
+    if (!response.ok) throw new Error(`HTTP ${response.status}`);
+    return response.json();
+}
+
+// Обновление всех моделей
+function updateAllModels(sourceModel) {
+    if (isUpdating) return;
+    currentModel = sourceModel;
+
+    const parse = sourceModel === 'rgb' ? parseInt : parseFloat;
+    const values = MODEL_FIELDS[sourceModel].map(
+        field => parse(document.getElementById(`${sourceModel}-${field}`).value)
+    );
+    converter.request(sourceModel, values);
 }
 
 // Обновление интерфейса
@@ -180,6 +329,10 @@ function updateUI(data, sourceModel) {
 
     // Обновляем предварительный просмотр и HEX
     updateColorPreview(data.rgb.r, data.rgb.g, data.rgb.b);
+
+    // Перцептивные модели (только отображение)
+    document.getElementById('xyzValue').textContent = `${data.xyz.x}, ${data.xyz.y}, ${data.xyz.z}`;
+    document.getElementById('labValue').textContent = `${data.lab.l}, ${data.lab.a}, ${data.lab.b}`;
 }
 
 // Установка значения слайдера и поля ввода
@@ -1,18 +1,40 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter
 import numpy as np
-from PIL import Image
+from PIL import Image, ImageOps, ExifTags
 import io
 import base64
 import cv2
 from typing import Optional, Literal
+from collections import OrderedDict
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import math
+import mmap
 import os
+import tempfile
+import threading
+import time
+import uuid
 
 app = FastAPI(title="Image Processing Lab 2")
 
+# Каталог приложения (статика ищется относительно него, а не текущего каталога)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+
+# Ограничения на загружаемые изображения (переопределяются переменными окружения)
+MAX_UPLOAD_BYTES = int(float(os.environ.get("LAB2_MAX_UPLOAD_MB", "50")) * 1024 * 1024)
+MAX_IMAGE_PIXELS = int(float(os.environ.get("LAB2_MAX_MEGAPIXELS", "100")) * 1_000_000)
+
+# Защита PIL от "декомпрессионных бомб" согласована с нашим лимитом
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
 # CORS для разработки
 app.add_middleware(
     CORSMiddleware,
@@ -25,10 +47,11 @@ app.add_middleware(
 
 class ThresholdParams(BaseModel):
     """Параметры пороговой обработки"""
-    method: Literal["otsu", "adaptive_mean", "adaptive_gaussian", "niblack"]
+    method: Literal["otsu", "otsu_multilevel", "adaptive_mean", "adaptive_gaussian", "niblack"]
     block_size: int = Field(11, ge=3, description="Размер блока (должен быть нечетным)")
     c_constant: float = Field(2.0, description="Константа для адаптивного порога")
     k_niblack: float = Field(-0.2, ge=-1, le=1, description="Коэффициент для метода Niblack")
+    n_thresholds: int = Field(2, ge=1, le=5, description="Число порогов для многоуровневого Оцу")
 
 
 class ContrastParams(BaseModel):
@@ -43,11 +66,41 @@ class ArithmeticParams(BaseModel):
     value: float = Field(50, description="Значение для операции")
 
 
+class HistogramMatchParams(BaseModel):
+    """Параметры приведения гистограммы к эталону"""
+    reference_id: Optional[str] = Field(None, description="Идентификатор загруженного эталона")
+    method: Literal["rgb", "hsv_v", "hls_l"] = "rgb"
+
+
+class CombineParams(BaseModel):
+    """Параметры операций над двумя изображениями"""
+    operation: Literal["add", "subtract", "absdiff", "multiply", "blend", "min", "max"]
+    alpha: float = Field(0.5, ge=0, le=1, description="Вес второго изображения для blend")
+    align: Literal["resize", "crop", "pad"] = Field("resize", description="Приведение размеров")
+    scope: Literal["preview", "full"] = Field("full", description="Для сессии: уменьшенная копия или полное разрешение")
+
+
 class HistogramParams(BaseModel):
     """Параметры эквализации гистограммы"""
     method: Literal["rgb", "hsv_v", "hls_l"]
 
 
+class OperationRequest(BaseModel):
+    """Операция и ее параметры (для предпросмотра и финального рендера)"""
+    operation: Literal["threshold", "contrast", "arithmetic", "histogram-equalization", "histogram-matching"]
+    params: dict = Field(default_factory=dict, description="Параметры операции")
+
+
+class StreamConfig(OperationRequest):
+    """Конфигурация потоковой обработки кадров (WebSocket)"""
+    input: Literal["encoded", "raw"] = Field("encoded", description="Сжатые кадры (JPEG/PNG) или сырые BGR/GRAY")
+    width: Optional[int] = Field(None, ge=1, description="Ширина сырого кадра")
+    height: Optional[int] = Field(None, ge=1, description="Высота сырого кадра")
+    channels: Literal[1, 3] = Field(3, description="Число каналов сырого кадра")
+    output: Literal["jpeg", "png", "raw"] = Field("jpeg", description="Формат обработанных кадров")
+    quality: int = Field(80, ge=1, le=100, description="Качество JPEG")
+
+
 def image_to_base64(image: np.ndarray) -> str:
     """Конвертация numpy массива в base64 строку"""
     # Конвертируем BGR в RGB для корректного отображения
@@ -63,16 +116,110 @@ def image_to_base64(image: np.ndarray) -> str:
     return f"data:image/png;base64,{img_str}"
 
 
-def load_image_from_upload(file_bytes: bytes) -> np.ndarray:
-    """Загрузка изображения из загруженного файла"""
-    image = Image.open(io.BytesIO(file_bytes))
-    # Конвертируем в RGB если необходимо
-    if image.mode != 'RGB':
-        image = image.convert('RGB')
-    # Конвертируем в numpy и BGR для OpenCV
-    img_array = np.array(image)
-    img_bgr = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
-    return img_bgr
+def check_upload_size(stream) -> int:
+    """
+    Проверка размера загруженного файла без чтения содержимого
+
+    Загрузки FastAPI хранятся во временном файле (SpooledTemporaryFile),
+    поэтому размер определяется перемещением к концу потока.
+    """
+    pos = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(pos)
+
+    if size == 0:
+        raise HTTPException(status_code=400, detail="Empty file")
+    if size > MAX_UPLOAD_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File too large: {size} bytes, limit {MAX_UPLOAD_BYTES} bytes"
+        )
+    return size
+
+
+def open_image_header(stream) -> Image.Image:
+    """
+    Чтение только заголовка изображения и проверка числа пикселей
+
+    Image.open не декодирует пиксели, поэтому слишком большие
+    изображения отклоняются до выделения памяти под них.
+    """
+    stream.seek(0)
+    try:
+        image = Image.open(stream)
+    except Image.DecompressionBombError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Image.UnidentifiedImageError:
+        raise HTTPException(status_code=400, detail="Unsupported image format")
+
+    w, h = image.size
+    if w * h > MAX_IMAGE_PIXELS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Image too large: {w}x{h} ({w * h / 1e6:.1f} MP), "
+                   f"limit {MAX_IMAGE_PIXELS / 1e6:.1f} MP"
+        )
+    return image
+
+
+def upload_buffer(stream) -> np.ndarray:
+    """
+    Сжатые байты загрузки как uint8-массив без копирования
+
+    - BytesIO (в том числе буфер SpooledTemporaryFile в памяти) - через getbuffer()
+    - временный файл на диске - через mmap
+    """
+    raw = getattr(stream, "_file", stream)
+    if isinstance(raw, io.BytesIO):
+        return np.frombuffer(raw.getbuffer(), dtype=np.uint8)
+    try:
+        mapped = mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        stream.seek(0)
+        return np.frombuffer(stream.read(), dtype=np.uint8)
+    return np.frombuffer(mapped, dtype=np.uint8)
+
+
+def load_image_from_upload(source, gray: bool = False) -> np.ndarray:
+    """
+    Загрузка изображения из загруженного файла
+
+    source - байты или файловый объект (например, UploadFile.file).
+    gray=True - сразу декодировать в оттенки серого (для операций,
+    которым нужна только яркость).
+
+    1. Проверяются размер файла и число пикселей (по заголовку)
+    2. OpenCV декодирует прямо в BGR/оттенки серого в один буфер,
+       учитывая EXIF-ориентацию
+    3. Форматы, которые OpenCV не читает, декодируются через PIL
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    check_upload_size(source)
+    header = open_image_header(source)
+
+    flags = cv2.IMREAD_GRAYSCALE if gray else cv2.IMREAD_COLOR
+    image = cv2.imdecode(upload_buffer(source), flags)
+    if image is not None:
+        return image
+
+    image = ImageOps.exif_transpose(header)
+    mode = 'L' if gray else 'RGB'
+    if image.mode != mode:
+        image = image.convert(mode)
+    img_array = np.asarray(image)
+    if gray:
+        return img_array
+    # Конвертируем в BGR для OpenCV
+    return cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
+
+
+def to_grayscale(image: np.ndarray) -> np.ndarray:
+    """Перевод в оттенки серого (одноканальное изображение возвращается как есть)"""
+    if image.ndim == 2:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
 
 def calculate_histogram(image: np.ndarray) -> dict:
@@ -106,9 +253,78 @@ def threshold_otsu(image: np.ndarray) -> np.ndarray:
     или максимизирует межклассовую дисперсию (between-class variance).
     Оптимален для изображений с бимодальной гистограммой.
     """
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    gray = to_grayscale(image)
     _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    return cv2.cvtColor(thresh, cv2.COLOR_GRAY2BGR)
+    return thresh
+
+
+def multi_otsu_thresholds(hist: np.ndarray, n_thresholds: int = 2) -> list[int]:
+    """
+    Многоуровневый метод Оцу по гистограмме (256 уровней)
+
+    Ищутся пороги t1 < t2 < ... < tn, разбивающие уровни яркости на n+1
+    классов с максимальной межклассовой дисперсией. Для класса (a, b]
+    вклад в дисперсию равен S(a, b)^2 / P(a, b), где P и S - сумма
+    вероятностей и первый момент. Оба считаются за O(1) по кумулятивным
+    таблицам, а оптимальное разбиение находится динамическим
+    программированием за O(n * 256^2).
+
+    Стоимость не зависит от размера изображения.
+    """
+    levels = len(hist)
+    p = np.asarray(hist, dtype=np.float64).ravel()
+    p = p / max(p.sum(), 1.0)
+
+    # Кумулятивные таблицы с нулем в начале: P[i] = p[0] + ... + p[i-1]
+    P = np.concatenate(([0.0], np.cumsum(p)))
+    S = np.concatenate(([0.0], np.cumsum(p * np.arange(levels))))
+
+    # H[a, b] - вклад класса из уровней a..b-1 (a < b)
+    dP = P[None, :] - P[:, None]
+    dS = S[None, :] - S[:, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        H = np.where(dP > 1e-12, dS * dS / dP, 0.0)
+    H[np.tril_indices(levels + 1)] = -np.inf
+
+    # best[b] - лучшая сумма для уровней 0..b-1, разбитых на k классов
+    best = H[0].copy()
+    splits = []
+    for _ in range(n_thresholds):
+        candidates = best[:, None] + H
+        arg = np.argmax(candidates, axis=0)
+        best = candidates[arg, np.arange(levels + 1)]
+        splits.append(arg)
+
+    # Восстанавливаем границы с конца
+    thresholds = []
+    end = levels
+    for arg in reversed(splits):
+        end = int(arg[end])
+        thresholds.append(end - 1)
+    return sorted(thresholds)
+
+
+def threshold_otsu_multilevel(image: np.ndarray, n_thresholds: int = 2) -> tuple[np.ndarray, list[int]]:
+    """
+    Многоуровневая пороговая обработка методом Оцу
+
+    Изображение разбивается на n_thresholds + 1 классов яркости,
+    каждый класс отображается в равномерно распределенный уровень серого.
+    После расчета гистограммы применяется одна LUT-операция.
+
+    Полезно для изображений, где больше двух классов (рентген, туман).
+    """
+    gray = to_grayscale(image)
+    hist = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel()
+    thresholds = multi_otsu_thresholds(hist, n_thresholds)
+    return cv2.LUT(gray, multilevel_lut(thresholds)), thresholds
+
+
+def multilevel_lut(thresholds: list[int]) -> np.ndarray:
+    """Таблица уровней: класс яркости -> равномерно распределенный уровень серого"""
+    # Класс уровня v - число порогов, меньших v
+    classes = np.searchsorted(np.array(thresholds), np.arange(256), side="left")
+    return np.round(classes * 255.0 / len(thresholds)).astype(np.uint8)
 
 
 def threshold_adaptive_mean(image: np.ndarray, block_size: int = 11, c: float = 2) -> np.ndarray:
@@ -122,7 +338,7 @@ def threshold_adaptive_mean(image: np.ndarray, block_size: int = 11, c: float =
     
     Подходит для изображений с неравномерным освещением.
     """
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    gray = to_grayscale(image)
     # Убедимся, что block_size нечетный
     if block_size % 2 == 0:
         block_size += 1
@@ -131,7 +347,7 @@ def threshold_adaptive_mean(image: np.ndarray, block_size: int = 11, c: float =
         gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, 
         cv2.THRESH_BINARY, block_size, c
     )
-    return cv2.cvtColor(thresh, cv2.COLOR_GRAY2BGR)
+    return thresh
 
 
 def threshold_adaptive_gaussian(image: np.ndarray, block_size: int = 11, c: float = 2) -> np.ndarray:
@@ -145,7 +361,7 @@ def threshold_adaptive_gaussian(image: np.ndarray, block_size: int = 11, c: floa
     
     Более устойчив к шуму по сравнению со средним арифметическим.
     """
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    gray = to_grayscale(image)
     if block_size % 2 == 0:
         block_size += 1
     
@@ -153,7 +369,7 @@ def threshold_adaptive_gaussian(image: np.ndarray, block_size: int = 11, c: floa
         gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
         cv2.THRESH_BINARY, block_size, c
     )
-    return cv2.cvtColor(thresh, cv2.COLOR_GRAY2BGR)
+    return thresh
 
 
 def threshold_niblack(image: np.ndarray, block_size: int = 15, k: float = -0.2) -> np.ndarray:
@@ -168,17 +384,12 @@ def threshold_niblack(image: np.ndarray, block_size: int = 15, k: float = -0.2)
     
     Эффективен для текстов и документов с неравномерным фоном.
     """
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY).astype(np.float64)
+    gray = to_grayscale(image).astype(np.float64)
     
     if block_size % 2 == 0:
         block_size += 1
     
-    # Вычисляем локальное среднее
-    mean = cv2.blur(gray, (block_size, block_size))
-    
-    # Вычисляем локальное стандартное отклонение
-    mean_sq = cv2.blur(gray ** 2, (block_size, block_size))
-    std = np.sqrt(mean_sq - mean ** 2)
+    mean, std = niblack_statistics(gray, block_size)
     
     # Применяем формулу Niblack
     threshold = mean + k * std
@@ -186,7 +397,238 @@ def threshold_niblack(image: np.ndarray, block_size: int = 15, k: float = -0.2)
     # Бинаризация
     binary = (gray > threshold).astype(np.uint8) * 255
     
-    return cv2.cvtColor(binary, cv2.COLOR_GRAY2BGR)
+    return binary
+
+
+def niblack_statistics(gray: np.ndarray, block_size: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Локальные среднее и стандартное отклонение для Niblack (float64)
+
+    Общая часть threshold_niblack и ThresholdWorkspace: перебор параметров
+    и сравнение методов дают ровно тот же результат, что /api/threshold.
+    """
+    # Вычисляем локальное среднее
+    mean = cv2.blur(gray, (block_size, block_size))
+    
+    # Вычисляем локальное стандартное отклонение
+    mean_sq = cv2.blur(gray ** 2, (block_size, block_size))
+    std = np.sqrt(mean_sq - mean ** 2)
+    return mean, std
+
+
+THRESHOLD_METHODS = ("otsu", "adaptive_mean", "adaptive_gaussian", "niblack")
+THRESHOLD_WORKERS = min(4, os.cpu_count() or 1)
+
+# Пул потоков для параллельного сравнения методов (OpenCV освобождает GIL)
+_threshold_executor = ThreadPoolExecutor(max_workers=THRESHOLD_WORKERS)
+
+
+class ThresholdWorkspace:
+    """
+    Общие промежуточные данные пороговых методов для одного изображения
+
+    - одно преобразование в оттенки серого
+    - кэш локальных средних (box и Гаусс) и средних квадратов по block_size
+
+    Кэш потокобезопасен: каждое размытие вычисляется один раз, даже если
+    методы выполняются параллельно. Адаптивные методы повторяют
+    cv2.adaptiveThreshold (float32, BORDER_REPLICATE), niblack -
+    threshold_niblack (float64, граница по умолчанию).
+    """
+
+    def __init__(self, image: np.ndarray):
+        self.gray = to_grayscale(image)
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def _cached(self, key, compute):
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key not in self._cache:
+                self._cache[key] = compute()
+            return self._cache[key]
+
+    def _gray_float(self) -> np.ndarray:
+        return self._cached("gray_f32", lambda: self.gray.astype(np.float32))
+
+    def box_mean(self, block_size: int) -> np.ndarray:
+        """Локальное среднее в окне block_size x block_size (float32)"""
+        return self._cached(("box", block_size), lambda: cv2.boxFilter(
+            self._gray_float(), cv2.CV_32F, (block_size, block_size),
+            borderType=cv2.BORDER_REPLICATE
+        ))
+
+    def gaussian_mean(self, block_size: int) -> np.ndarray:
+        """Взвешенное по Гауссу локальное среднее (float32)"""
+        return self._cached(("gauss", block_size), lambda: cv2.GaussianBlur(
+            self._gray_float(), (block_size, block_size), 0,
+            borderType=cv2.BORDER_REPLICATE
+        ))
+
+    def _gray_double(self) -> np.ndarray:
+        return self._cached("gray_f64", lambda: self.gray.astype(np.float64))
+
+    def niblack_statistics(self, block_size: int) -> tuple[np.ndarray, np.ndarray]:
+        """Локальные среднее и стандартное отклонение Niblack (float64)"""
+        return self._cached(("niblack", block_size),
+                            lambda: niblack_statistics(self._gray_double(), block_size))
+
+    def adaptive_difference(self, method: str, block_size: int) -> np.ndarray:
+        """
+        Разность яркости и локального среднего для адаптивных методов:
+        gray - round(mean) (int16, как в OpenCV)
+
+        Не зависит от C, поэтому при переборе параметров вычисляется
+        один раз на block_size, а каждое значение C - одно сравнение.
+        """
+        def compute():
+            blur = self.box_mean(block_size) if method == "adaptive_mean" else self.gaussian_mean(block_size)
+            # Как в OpenCV: среднее округляется до uint8
+            return self.gray.astype(np.int16) - np.rint(blur).astype(np.int16)
+        return self._cached(("diff", method, block_size), compute)
+
+    def threshold(self, method: str, block_size: int = 11, c: float = 2,
+                  k: float = -0.2) -> tuple[np.ndarray, Optional[float]]:
+        """
+        Бинаризация выбранным методом
+
+        Возвращает одноканальный результат (0/255) и найденный
+        глобальный порог (только для метода Оцу).
+        """
+        if block_size % 2 == 0:
+            block_size += 1
+
+        if method == "otsu":
+            value, binary = cv2.threshold(self.gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+            return binary, float(value)
+
+        if method in ("adaptive_mean", "adaptive_gaussian"):
+            # gray > mean - C; C округляется вверх до целого, как в OpenCV
+            diff = self.adaptive_difference(method, block_size)
+            return cv2.compare(diff, -math.ceil(c), cv2.CMP_GT), None
+
+        if method == "niblack":
+            # Те же операции, что в threshold_niblack: gray > mean + k * std
+            mean, std = self.niblack_statistics(block_size)
+            return (self._gray_double() > mean + k * std).astype(np.uint8) * 255, None
+
+        raise ValueError(f"Unknown threshold method: {method}")
+
+
+def compare_thresholds(image: np.ndarray, methods, block_size: int = 11, c: float = 2,
+                       k: float = -0.2, parallel: bool = False) -> dict:
+    """
+    Выполнение нескольких пороговых методов на одном изображении
+
+    Все методы используют общий ThresholdWorkspace. При parallel=True
+    методы выполняются в пуле потоков.
+
+    Возвращает {method: {"binary", "threshold", "time_ms"}}.
+    """
+    workspace = ThresholdWorkspace(image)
+
+    def run(method):
+        start = time.perf_counter()
+        binary, value = workspace.threshold(method, block_size, c, k)
+        return {
+            "binary": binary,
+            "threshold": value,
+            "time_ms": (time.perf_counter() - start) * 1000
+        }
+
+    if parallel and len(methods) > 1:
+        results = list(_threshold_executor.map(run, methods))
+    else:
+        results = [run(method) for method in methods]
+    return dict(zip(methods, results))
+
+
+SWEEP_METHODS = ("adaptive_mean", "adaptive_gaussian", "niblack")
+SWEEP_MAX_COMBINATIONS = 120
+
+
+def sweep_thresholds(image: np.ndarray, methods, block_sizes, c_values, k_values,
+                     thumb_size: int = 200) -> tuple[np.ndarray, tuple[int, int], list[dict], list[dict]]:
+    """
+    Перебор параметров адаптивных методов на одном изображении
+
+    Для каждой пары (метод, block_size) размытие и разность с яркостью
+    (для niblack - локальные среднее и отклонение) вычисляются один раз
+    (ThresholdWorkspace), а каждое значение C (adaptive_mean/adaptive_gaussian)
+    или k (niblack) - одно сравнение.
+
+    Результаты уменьшаются до миниатюр и собираются в мозаику:
+    строка - (метод, block_size), столбец - значение C или k.
+
+    Возвращает мозаику, размер ячейки (ширина, высота), статистику
+    по комбинациям и время общих этапов.
+    """
+    workspace = ThresholdWorkspace(image)
+    h, w = workspace.gray.shape
+    scale = min(1.0, thumb_size / max(h, w))
+    tile_w, tile_h = max(1, round(w * scale)), max(1, round(h * scale))
+
+    rows = [(method, block_size) for method in methods for block_size in block_sizes]
+    # Столбцов столько, сколько значений у выбранных методов:
+    # k учитываются только при niblack, C - только при адаптивных
+    columns = max(len(k_values) if method == "niblack" else len(c_values) for method in methods)
+    # Белый фон для пустых ячеек (когда C и k разной длины)
+    mosaic = np.full((len(rows) * tile_h, columns * tile_w), 255, dtype=np.uint8)
+
+    results, shared = [], []
+    for row, (method, block_size) in enumerate(rows):
+        start = time.perf_counter()
+        if method == "niblack":
+            workspace.niblack_statistics(block_size)
+        else:
+            workspace.adaptive_difference(method, block_size)
+        shared.append({
+            "method": method,
+            "block_size": block_size,
+            "time_ms": round((time.perf_counter() - start) * 1000, 3)
+        })
+
+        values = k_values if method == "niblack" else c_values
+        for col, value in enumerate(values):
+            start = time.perf_counter()
+            if method == "niblack":
+                binary, _ = workspace.threshold(method, block_size, k=value)
+            else:
+                binary, _ = workspace.threshold(method, block_size, c=value)
+            elapsed = time.perf_counter() - start
+
+            mosaic[row * tile_h:(row + 1) * tile_h, col * tile_w:(col + 1) * tile_w] = \
+                cv2.resize(binary, (tile_w, tile_h), interpolation=cv2.INTER_AREA)
+            results.append({
+                "method": method,
+                "block_size": block_size,
+                "k_niblack" if method == "niblack" else "c_constant": value,
+                "row": row,
+                "column": col,
+                "foreground_ratio": cv2.countNonZero(binary) / binary.size,
+                "time_ms": round(elapsed * 1000, 3)
+            })
+
+    return mosaic, (tile_w, tile_h), results, shared
+
+
+def binary_to_base64(binary: np.ndarray, packed: bool = False) -> str:
+    """
+    Кодирование бинарного изображения в PNG (base64)
+
+    packed=True - 1 бит на пиксель (режим '1' PIL), что в 8 раз
+    уменьшает объем данных для кодирования.
+    """
+    if not packed:
+        return image_to_base64(binary)
+    pil_img = Image.frombytes('1', (binary.shape[1], binary.shape[0]),
+                              np.packbits(binary > 0, axis=1).tobytes())
+    buff = io.BytesIO()
+    pil_img.save(buff, format="PNG")
+    img_str = base64.b64encode(buff.getvalue()).decode()
+    return f"data:image/png;base64,{img_str}"
 
 
 # ============= КОНТРАСТИРОВАНИЕ И ПОЭЛЕМЕНТНЫЕ ОПЕРАЦИИ =============
@@ -230,25 +672,111 @@ def arithmetic_operation(image: np.ndarray, operation: str, value: float) -> np.
     - divide: pixel / value (уменьшение интенсивности)
     
     Результаты автоматически обрезаются до диапазона [0, 255]
-    """
-    img_float = image.astype(np.float64)
     
+    Для uint8 операция вычисляется один раз для 256 уровней и применяется
+    через cv2.LUT - без вещественной копии всего изображения.
+    """
+    if operation == "divide" and value == 0:
+        value = 1
+
+    if image.dtype == np.uint8:
+        levels = np.arange(256, dtype=np.float64)
+        if operation == "add":
+            table = levels + value
+        elif operation == "subtract":
+            table = levels - value
+        elif operation == "multiply":
+            table = levels * (value / 100.0)  # Нормализуем для удобства
+        elif operation == "divide":
+            table = levels / (value / 100.0)
+        else:
+            table = levels
+        # Обрезаем значения до диапазона [0, 255]
+        table = np.clip(table, 0, 255).astype(np.uint8)
+        return cv2.LUT(image, table)
+
+    # uint16 и прочие типы: насыщающая арифметика OpenCV в исходном типе
     if operation == "add":
-        result = cv2.add(img_float, value)
-    elif operation == "subtract":
-        result = cv2.subtract(img_float, value)
-    elif operation == "multiply":
-        result = img_float * (value / 100.0)  # Нормализуем для удобства
-    elif operation == "divide":
-        if value == 0:
-            value = 1
-        result = img_float / (value / 100.0)
-    else:
-        result = img_float
-    
-    # Обрезаем значения до диапазона [0, 255]
-    result = np.clip(result, 0, 255)
-    return result.astype(np.uint8)
+        return cv2.add(image, value)
+    if operation == "subtract":
+        return cv2.subtract(image, value)
+    if operation == "multiply":
+        return cv2.multiply(image, 1.0, scale=value / 100.0)
+    if operation == "divide":
+        return cv2.multiply(image, 1.0, scale=100.0 / value)
+    return image.copy()
+
+
+# ============= ОПЕРАЦИИ НАД ДВУМЯ ИЗОБРАЖЕНИЯМИ =============
+
+def align_images(base: np.ndarray, other: np.ndarray, mode: str = "resize") -> tuple[np.ndarray, np.ndarray]:
+    """
+    Приведение второго изображения к размеру и числу каналов первого
+
+    - resize: второе масштабируется до размера первого
+    - crop: оба обрезаются до общей области (срезы без копирования)
+    - pad: второе обрезается или дополняется нулями до размера первого
+
+    Число каналов и тип (uint8/uint16) приводятся к первому изображению.
+    """
+    if other.ndim != base.ndim:
+        if base.ndim == 2:
+            other = cv2.cvtColor(other, cv2.COLOR_BGR2GRAY)
+        else:
+            other = cv2.cvtColor(other, cv2.COLOR_GRAY2BGR)
+    if other.dtype != base.dtype:
+        # 65535 = 255 * 257, поэтому перевод между 8 и 16 битами точен
+        if base.dtype == np.uint8:
+            other = cv2.convertScaleAbs(other, alpha=1 / 257)
+        else:
+            other = other.astype(np.uint16) * np.uint16(257)
+
+    h, w = base.shape[:2]
+    oh, ow = other.shape[:2]
+    if (oh, ow) == (h, w):
+        return base, other
+
+    if mode == "crop":
+        ch, cw = min(h, oh), min(w, ow)
+        return base[:ch, :cw], other[:ch, :cw]
+    if mode == "pad":
+        other = other[:h, :w]
+        return base, cv2.copyMakeBorder(other, 0, h - other.shape[0], 0, w - other.shape[1],
+                                        cv2.BORDER_CONSTANT, value=0)
+    interpolation = cv2.INTER_AREA if oh * ow > h * w else cv2.INTER_LINEAR
+    return base, cv2.resize(other, (w, h), interpolation=interpolation)
+
+
+def combine_images(first: np.ndarray, second: np.ndarray, operation: str,
+                   alpha: float = 0.5, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Поэлементные операции над двумя изображениями одного размера
+
+    - add, subtract: сложение и вычитание с насыщением
+    - absdiff: модуль разности (изображение изменений)
+    - multiply: произведение, нормированное на максимум типа (a * b / 255)
+    - blend: альфа-смешивание (1 - alpha) * a + alpha * b
+    - min, max: попиксельный минимум и максимум
+
+    Вычисления идут в исходном типе (uint8/uint16) с насыщающей
+    арифметикой OpenCV, без промежуточных float64-копий. Если передан
+    out (например, out=first), результат записывается в него на месте.
+    """
+    if operation == "add":
+        return cv2.add(first, second, dst=out)
+    if operation == "subtract":
+        return cv2.subtract(first, second, dst=out)
+    if operation == "absdiff":
+        return cv2.absdiff(first, second, dst=out)
+    if operation == "multiply":
+        return cv2.multiply(first, second, dst=out, scale=1.0 / np.iinfo(first.dtype).max)
+    if operation == "blend":
+        return cv2.addWeighted(first, 1.0 - alpha, second, alpha, 0.0, dst=out)
+    if operation == "min":
+        return cv2.min(first, second, dst=out)
+    if operation == "max":
+        return cv2.max(first, second, dst=out)
+    raise ValueError(f"Unknown combine operation: {operation}")
 
 
 # ============= ЭКВАЛИЗАЦИЯ ГИСТОГРАММЫ =============
@@ -335,12 +863,694 @@ def histogram_equalization_hls_l(image: np.ndarray) -> np.ndarray:
     return result
 
 
+# ============= ПРИВЕДЕНИЕ ГИСТОГРАММЫ К ЭТАЛОНУ =============
+
+REFERENCE_CACHE_SIZE = 32
+
+# reference_id -> {"cdfs", "width", "height", "histogram"}; самые старые вытесняются
+_references: "OrderedDict[str, dict]" = OrderedDict()
+
+
+def histogram_cdf(hist: np.ndarray) -> np.ndarray:
+    """Нормированная кумулятивная функция распределения по гистограмме"""
+    cdf = np.cumsum(np.ravel(hist), dtype=np.float64)
+    return cdf / cdf[-1]
+
+
+def channel_cdf(image: np.ndarray, channel: int = 0) -> np.ndarray:
+    """Нормированная кумулятивная функция распределения канала (256 значений)"""
+    return histogram_cdf(cv2.calcHist([image], [channel], None, [256], [0, 256]))
+
+
+def reference_cdfs(image: np.ndarray) -> dict:
+    """
+    CDF эталона для всех способов сопоставления
+
+    - rgb: по одной CDF на каналы B, G, R
+    - hsv_v, hls_l: только канал яркости V или светлоты L
+    - gray: яркость для одноканальных изображений
+    """
+    if image.ndim == 2:
+        cdf = channel_cdf(image)
+        return {"rgb": np.stack([cdf, cdf, cdf]), "hsv_v": cdf, "hls_l": cdf, "gray": cdf}
+
+    return {
+        "rgb": np.stack([channel_cdf(image, c) for c in range(3)]),
+        "hsv_v": channel_cdf(cv2.cvtColor(image, cv2.COLOR_BGR2HSV), 2),
+        "hls_l": channel_cdf(cv2.cvtColor(image, cv2.COLOR_BGR2HLS), 1),
+        "gray": channel_cdf(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)),
+    }
+
+
+def matching_lut(source_cdf: np.ndarray, reference_cdf: np.ndarray) -> np.ndarray:
+    """
+    Таблица преобразования уровней для приведения гистограммы
+
+    Каждый уровень источника переходит в наименьший уровень эталона,
+    у которого CDF не меньше CDF источника.
+    """
+    lut = np.searchsorted(reference_cdf, source_cdf, side="left")
+    return np.minimum(lut, 255).astype(np.uint8)
+
+
+def register_reference(image: np.ndarray, reference_id: str) -> dict:
+    """Сохранение CDF эталона (вычисляются один раз на эталон)"""
+    entry = _references.get(reference_id)
+    if entry is None:
+        entry = {
+            "cdfs": reference_cdfs(image),
+            "width": image.shape[1],
+            "height": image.shape[0],
+            "histogram": calculate_histogram(image),
+        }
+        _references[reference_id] = entry
+        while len(_references) > REFERENCE_CACHE_SIZE:
+            _references.popitem(last=False)
+    _references.move_to_end(reference_id)
+    return entry
+
+
+def histogram_matching(image: np.ndarray, cdfs: dict, method: str = "rgb") -> np.ndarray:
+    """
+    Приведение гистограммы изображения к гистограмме эталона
+
+    - rgb: каждый канал B, G, R сопоставляется отдельно; все три таблицы
+      применяются одним проходом cv2.LUT
+    - hsv_v, hls_l: сопоставляется только яркость (как в эквализации
+      histogram_equalization_hsv_v / histogram_equalization_hls_l),
+      цветовой тон и насыщенность сохраняются
+
+    На изображение приходится одна гистограмма и один проход LUT.
+    """
+    if image.ndim == 2:
+        return cv2.LUT(image, matching_lut(channel_cdf(image), cdfs["gray"]))
+
+    if method == "rgb":
+        lut = np.stack([matching_lut(channel_cdf(image, c), cdfs["rgb"][c]) for c in range(3)], axis=1)
+        return cv2.LUT(image, lut.reshape(1, 256, 3))
+
+    if method == "hsv_v":
+        to_space, from_space, channel = cv2.COLOR_BGR2HSV, cv2.COLOR_HSV2BGR, 2
+    else:
+        to_space, from_space, channel = cv2.COLOR_BGR2HLS, cv2.COLOR_HLS2BGR, 1
+    converted = cv2.cvtColor(image, to_space)
+    planes = list(cv2.split(converted))
+    planes[channel] = cv2.LUT(planes[channel], matching_lut(channel_cdf(converted, channel), cdfs[method]))
+    return cv2.cvtColor(cv2.merge(planes), from_space)
+
+
+# ============= ДИСПЕТЧЕР ОПЕРАЦИЙ =============
+
+OPERATION_PARAMS = {
+    "threshold": ThresholdParams,
+    "contrast": ContrastParams,
+    "arithmetic": ArithmeticParams,
+    "histogram-equalization": HistogramParams,
+    "histogram-matching": HistogramMatchParams,
+}
+
+
+def scale_block_size(block_size: int, scale: float) -> int:
+    """
+    Масштабирование размера окрестности под уменьшенную копию изображения
+
+    Окно block_size задано в пикселях полного разрешения. На копии,
+    уменьшенной в 1/scale раз, та же область покрывается окном
+    block_size * scale. Результат остается нечетным и не меньше 3.
+    """
+    scaled = max(3, int(round(block_size * scale)))
+    if scaled % 2 == 0:
+        scaled += 1
+    return scaled
+
+
+def apply_operation(image: np.ndarray, operation: str, params: dict,
+                    scale: float = 1.0) -> tuple[np.ndarray, dict]:
+    """
+    Применение операции по имени с проверкой параметров
+
+    scale - отношение размера обрабатываемого изображения к полному
+    (1.0 для полного разрешения). Используется для согласования
+    локальных параметров, чтобы предпросмотр совпадал с результатом.
+
+    Возвращает результат и нормализованные параметры.
+    """
+    model = OPERATION_PARAMS.get(operation)
+    if model is None:
+        raise ValueError(f"Unknown operation: {operation}")
+    p = model(**params)
+    info = p.model_dump()
+
+    if operation == "threshold":
+        block_size = scale_block_size(p.block_size, scale)
+        if p.method == "otsu":
+            result = threshold_otsu(image)
+        elif p.method == "otsu_multilevel":
+            result, info["thresholds"] = threshold_otsu_multilevel(image, p.n_thresholds)
+        elif p.method == "adaptive_mean":
+            result = threshold_adaptive_mean(image, block_size, p.c_constant)
+        elif p.method == "adaptive_gaussian":
+            result = threshold_adaptive_gaussian(image, block_size, p.c_constant)
+        else:
+            result = threshold_niblack(image, block_size, p.k_niblack)
+    elif operation == "contrast":
+        result = linear_contrast(image, p.alpha, p.beta)
+    elif operation == "arithmetic":
+        result = arithmetic_operation(image, p.operation, p.value)
+    elif operation == "histogram-matching":
+        reference = _references.get(p.reference_id)
+        if reference is None:
+            raise ValueError(f"Unknown reference_id: {p.reference_id}")
+        result = histogram_matching(image, reference["cdfs"], p.method)
+    else:
+        if image.ndim == 2:
+            # Для одноканального изображения (например, после порога) все методы
+            # сводятся к эквализации яркости
+            result = cv2.equalizeHist(image)
+        elif p.method == "rgb":
+            result = histogram_equalization_rgb(image)
+        elif p.method == "hsv_v":
+            result = histogram_equalization_hsv_v(image)
+        else:
+            result = histogram_equalization_hls_l(image)
+
+    return result, info
+
+
+def point_operation_lut(operation: str, params: BaseModel) -> Optional[np.ndarray]:
+    """
+    Таблица преобразования (256 значений) для поэлементных операций
+
+    Строится применением самой операции к строке 0..255, поэтому
+    результат cv2.LUT совпадает с прямым вычислением бит в бит.
+    Для операций, зависящих от соседей или гистограммы, возвращает None.
+    """
+    levels = np.arange(256, dtype=np.uint8).reshape(1, 256)
+    if operation == "contrast":
+        return linear_contrast(levels, params.alpha, params.beta).ravel()
+    if operation == "arithmetic":
+        return arithmetic_operation(levels, params.operation, params.value).ravel()
+    return None
+
+
+# ============= ПРЕДПРОСМОТР (PROXY) =============
+
+PREVIEW_MAX_DIM = 1024
+PREVIEW_CACHE_SIZE = 16
+# Сессия держит исходные байты загрузки (до MAX_UPLOAD_BYTES) и proxy,
+# поэтому хранилище ограничено и числом сессий, и суммарным объемом
+PREVIEW_CACHE_BYTES = int(float(os.environ.get("LAB2_PREVIEW_CACHE_MB", "256")) * 1024 * 1024)
+
+# session_id -> {"data", "digest", "proxy", "scale", "full_size", "nbytes"};
+# самые старые вытесняются
+_preview_sessions: "OrderedDict[str, dict]" = OrderedDict()
+_preview_sessions_bytes = 0
+
+
+def store_preview_session(session_id: str, session: dict):
+    """
+    Сохранение сессии с вытеснением самых старых
+
+    Вытеснение идет, пока превышено число сессий или их суммарный
+    объем; только что созданная сессия сохраняется всегда.
+    """
+    global _preview_sessions_bytes
+    session["nbytes"] = len(session["data"]) + session["proxy"].nbytes
+    _preview_sessions[session_id] = session
+    _preview_sessions_bytes += session["nbytes"]
+    while len(_preview_sessions) > 1 and (
+        len(_preview_sessions) > PREVIEW_CACHE_SIZE or _preview_sessions_bytes > PREVIEW_CACHE_BYTES
+    ):
+        _, evicted = _preview_sessions.popitem(last=False)
+        _preview_sessions_bytes -= evicted["nbytes"]
+
+
+def load_preview_from_upload(file_bytes: bytes, max_dim: int = PREVIEW_MAX_DIM) -> tuple[np.ndarray, float, tuple[int, int]]:
+    """
+    Декодирование уменьшенной копии (proxy) изображения
+
+    Для JPEG используется draft-режим PIL: декодер сразу масштабирует
+    DCT-блоки в 1/2, 1/4 или 1/8, не восстанавливая полное разрешение.
+    Затем копия доуменьшается так, чтобы большая сторона не превышала max_dim,
+    и поворачивается согласно EXIF-ориентации.
+
+    Возвращает proxy (BGR), масштаб proxy/оригинал и размер оригинала (w, h)
+    с учетом ориентации.
+    """
+    stream = io.BytesIO(file_bytes)
+    check_upload_size(stream)
+    image = open_image_header(stream)
+    full_w, full_h = image.size
+    # Ориентации 5-8 меняют местами ширину и высоту
+    if image.getexif().get(ExifTags.Base.Orientation, 1) in (5, 6, 7, 8):
+        full_w, full_h = full_h, full_w
+
+    ratio = min(1.0, max_dim / max(full_w, full_h))
+    target = (max(1, math.ceil(image.width * ratio)), max(1, math.ceil(image.height * ratio)))
+
+    # Для форматов без поддержки draft вызов ничего не делает
+    image.draft("RGB", target)
+    image.thumbnail((max_dim, max_dim))
+    image = ImageOps.exif_transpose(image)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    img_bgr = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
+    scale = img_bgr.shape[1] / full_w
+    return img_bgr, scale, (full_w, full_h)
+
+
+def get_preview_session(session_id: str) -> dict:
+    """Получение сессии предпросмотра (с обновлением порядка LRU)"""
+    session = _preview_sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Preview session not found")
+    _preview_sessions.move_to_end(session_id)
+    return session
+
+
+def make_result_response(image: np.ndarray, result: np.ndarray, **extra) -> JSONResponse:
+    """Формирование стандартного ответа: изображения + гистограммы"""
+    return JSONResponse({
+        "original": image_to_base64(image),
+        "result": image_to_base64(result),
+        "histogram_original": calculate_histogram(image),
+        "histogram_result": calculate_histogram(result),
+        **extra
+    })
+
+
+# ============= АСИНХРОННЫЕ ЗАДАЧИ =============
+
+JOB_WORKERS = max(1, min(4, os.cpu_count() or 1))
+JOB_MAX_STORED = 64
+JOB_TTL_SECONDS = 600
+
+# job_id -> запись задачи; готовые задачи удаляются через JOB_TTL_SECONDS
+_jobs: "OrderedDict[str, dict]" = OrderedDict()
+_jobs_lock = threading.Lock()
+_job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="lab2-job")
+
+_pipeline_adapter = TypeAdapter(list[OperationRequest])
+
+# Поля записи, которые не отдаются клиенту
+_JOB_PRIVATE_FIELDS = ("future", "result")
+
+
+def purge_jobs():
+    """Удаление просроченных готовых задач (вызывать под _jobs_lock)"""
+    now = time.time()
+    expired = [job_id for job_id, job in _jobs.items()
+               if job["expires_at"] is not None and job["expires_at"] <= now]
+    for job_id in expired:
+        del _jobs[job_id]
+
+
+def update_job(job_id: str, **fields):
+    """Обновление записи задачи из рабочего потока"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is not None:
+            job.update(fields)
+
+
+def run_job(job_id: str, data: bytes, pipeline: list[OperationRequest]):
+    """
+    Выполнение задачи в пуле потоков
+
+    Прогресс обновляется после каждого шага: декодирование,
+    каждая операция цепочки, кодирование результата в PNG.
+    """
+    update_job(job_id, status="running", started_at=time.time())
+    try:
+        update_job(job_id, current_step="decode")
+        image = load_image_from_upload(data)
+        update_job(job_id, completed_steps=1, width=image.shape[1], height=image.shape[0])
+
+        for index, step in enumerate(pipeline):
+            update_job(job_id, current_step=step.operation)
+            image, _ = apply_operation(image, step.operation, step.params)
+            update_job(job_id, completed_steps=index + 2)
+
+        update_job(job_id, current_step="encode")
+        ok, encoded = cv2.imencode(".png", image)
+        if not ok:
+            raise RuntimeError("PNG encoding failed")
+
+        now = time.time()
+        update_job(job_id, status="done", result=encoded.tobytes(), current_step=None,
+                   completed_steps=len(pipeline) + 2, finished_at=now,
+                   expires_at=now + JOB_TTL_SECONDS)
+    except Exception as e:
+        now = time.time()
+        update_job(job_id, status="failed", error=str(e), finished_at=now,
+                   expires_at=now + JOB_TTL_SECONDS)
+
+
+def job_status(job: dict) -> dict:
+    """Публичное представление задачи"""
+    status = {k: v for k, v in job.items() if k not in _JOB_PRIVATE_FIELDS}
+    status["progress"] = job["completed_steps"] / job["total_steps"]
+    return status
+
+
+# ============= КЭШ РЕЗУЛЬТАТОВ =============
+
+CACHE_MEMORY_BYTES = int(float(os.environ.get("LAB2_CACHE_MEMORY_MB", "256")) * 1024 * 1024)
+CACHE_DISK_BYTES = int(float(os.environ.get("LAB2_CACHE_DISK_MB", "2048")) * 1024 * 1024)
+CACHE_DIR = os.environ.get("LAB2_CACHE_DIR", os.path.join(tempfile.gettempdir(), "lab2-cache"))
+# Версия формата ответов: увеличивать при любом изменении результата операций
+# или структуры ответа, иначе с диска будут отдаваться старые ответы.
+# 2 - одноканальный результат threshold
+CACHE_VERSION = 2
+
+
+class ResultCache:
+    """
+    Кэш готовых ответов с адресацией по содержимому
+
+    Два уровня:
+    - память: LRU с ограничением суммарного размера в байтах
+    - диск: каталог файлов (имя = ключ), LRU с ограничением размера;
+      переживает перезапуск сервера
+
+    Запись идет в оба уровня, попадание на диске переносит запись в память.
+    Ключ строится из хэша исходных байтов и канонических параметров
+    (см. result_cache_key), поэтому повторный запрос не декодирует
+    изображение и не вызывает OpenCV.
+
+    Индекс диска читается при первом обращении, а не при импорте:
+    batch.py и tiled.py импортируют app в каждом процессе, но кэш
+    не используют.
+    """
+
+    def __init__(self, memory_bytes: int, disk_bytes: int, disk_dir: str):
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.disk_dir = disk_dir
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_size = 0
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "memory_hits": 0, "disk_hits": 0, "misses": 0,
+            "memory_evictions": 0, "disk_evictions": 0
+        }
+        self._disk_loaded = self.disk_bytes <= 0
+
+    def _ensure_disk_index(self):
+        """Загрузка индекса диска при первом обращении (вызывается под блокировкой)"""
+        if not self._disk_loaded:
+            self._disk_loaded = True
+            self._load_disk_index()
+
+    def _load_disk_index(self):
+        """
+        Восстановление индекса диска (порядок LRU - по времени изменения)
+
+        Файлы прежних версий (CACHE_VERSION) не совпадают ни с одним
+        новым ключом и вытесняются первыми как самые старые.
+        """
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            entries = []
+            for entry in os.scandir(self.disk_dir):
+                if entry.is_file() and not entry.name.endswith(".partial"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name, stat.st_size))
+        except OSError:
+            self.disk_bytes = 0
+            return
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+        self._trim_disk()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key)
+
+    def _put_memory(self, key: str, value: bytes):
+        if len(value) > self.memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key))
+        self._memory[key] = value
+        self._memory_size += len(value)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+            self._stats["memory_evictions"] += 1
+
+    def _trim_disk(self):
+        while self._disk_size > self.disk_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            self._stats["disk_evictions"] += 1
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            self._ensure_disk_index()
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return value
+            on_disk = key in self._disk
+
+        if on_disk:
+            try:
+                with open(self._disk_path(key), "rb") as f:
+                    value = f.read()
+                os.utime(self._disk_path(key))
+            except OSError:
+                value = None
+
+        with self._lock:
+            if value is None:
+                self._stats["misses"] += 1
+                if on_disk and key in self._disk:
+                    self._disk_size -= self._disk.pop(key)
+                return None
+            self._stats["disk_hits"] += 1
+            if key in self._disk:
+                self._disk.move_to_end(key)
+            self._put_memory(key, value)
+            return value
+
+    def put(self, key: str, value: bytes):
+        with self._lock:
+            self._ensure_disk_index()
+            self._put_memory(key, value)
+            if self.disk_bytes <= 0 or len(value) > self.disk_bytes or key in self._disk:
+                return
+
+        # Запись во временный файл и переименование - читатель не увидит половину
+        tmp = f"{self._disk_path(key)}.{threading.get_ident()}.partial"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(value)
+            os.replace(tmp, self._disk_path(key))
+        except OSError:
+            return
+
+        with self._lock:
+            if key not in self._disk:
+                self._disk[key] = len(value)
+                self._disk_size += len(value)
+                self._trim_disk()
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._ensure_disk_index()
+            lookups = self._stats["memory_hits"] + self._stats["disk_hits"] + self._stats["misses"]
+            hits = lookups - self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_ratio": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_size,
+                "memory_limit_bytes": self.memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_size,
+                "disk_limit_bytes": self.disk_bytes,
+            }
+
+
+result_cache = ResultCache(CACHE_MEMORY_BYTES, CACHE_DISK_BYTES, CACHE_DIR)
+
+
+def upload_digest(stream) -> str:
+    """Хэш содержимого загрузки (читается блоками, без декодирования)"""
+    digest = hashlib.blake2b(digest_size=20)
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(1024 * 1024), b""):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def result_cache_key(stream, operation: str, params: dict) -> str:
+    """
+    Ключ кэша: хэш изображения + каноническая запись операции
+
+    Параметры сериализуются в JSON с сортировкой ключей,
+    числа приводятся к float (11 и 11.0 дают один ключ).
+    CACHE_VERSION входит в ключ, поэтому после изменения
+    результатов старые записи не находятся.
+    """
+    return digest_cache_key(upload_digest(stream), operation, params)
+
+
+def digest_cache_key(source_digest: str, operation: str, params: dict) -> str:
+    """Ключ кэша по уже известному хэшу изображения (см. result_cache_key)"""
+    canonical = json.dumps(
+        {
+            "version": CACHE_VERSION,
+            "operation": operation,
+            "params": {k: float(v) if isinstance(v, (int, float)) and not isinstance(v, bool) else v
+                       for k, v in params.items()}
+        },
+        sort_keys=True, separators=(",", ":")
+    )
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(source_digest.encode())
+    digest.update(canonical.encode())
+    return digest.hexdigest()
+
+
+def cached_json_response(body: bytes, hit: bool) -> Response:
+    """Ответ с уже сериализованным JSON"""
+    return Response(content=body, media_type="application/json",
+                    headers={"X-Cache": "HIT" if hit else "MISS"})
+
+
+def store_json_response(key: str, payload: dict) -> Response:
+    """Сериализация ответа, запись в кэш и отправка"""
+    body = json.dumps(payload, separators=(",", ":")).encode()
+    result_cache.put(key, body)
+    return cached_json_response(body, hit=False)
+
+
+# ============= ПОТОКОВАЯ ОБРАБОТКА КАДРОВ =============
+
+class FrameProcessor:
+    """
+    Обработка последовательности кадров с фиксированной операцией
+
+    Параметры проверяются и LUT строится один раз на конфигурацию.
+    Рабочие буферы (оттенки серого, результат) выделяются при первом
+    кадре и переиспользуются, пока не изменится размер кадра.
+    Поэлементные операции выполняются одним cv2.LUT в готовый буфер.
+    """
+
+    def __init__(self, config: StreamConfig):
+        if config.input == "raw" and (config.width is None or config.height is None):
+            raise ValueError("width and height are required for raw input")
+        self.config = config
+        self.params = OPERATION_PARAMS[config.operation](**config.params)
+        self.lut = point_operation_lut(config.operation, self.params)
+        self._buffers = {}
+
+        if config.output == "jpeg":
+            self._encode_ext, self._encode_params = ".jpg", [cv2.IMWRITE_JPEG_QUALITY, config.quality]
+        elif config.output == "png":
+            # Быстрое сжатие: для потока важнее задержка, чем размер
+            self._encode_ext, self._encode_params = ".png", [cv2.IMWRITE_PNG_COMPRESSION, 1]
+        else:
+            self._encode_ext, self._encode_params = None, []
+
+    def _buffer(self, name: str, shape: tuple) -> np.ndarray:
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape:
+            buf = np.empty(shape, dtype=np.uint8)
+            self._buffers[name] = buf
+        return buf
+
+    def decode(self, data: bytes) -> np.ndarray:
+        """Декодирование кадра; сырые кадры используются без копирования"""
+        if len(data) > MAX_UPLOAD_BYTES:
+            raise ValueError("Frame too large")
+        buf = np.frombuffer(data, dtype=np.uint8)
+
+        if self.config.input == "raw":
+            c = self.config
+            shape = (c.height, c.width) if c.channels == 1 else (c.height, c.width, 3)
+            if buf.size != c.height * c.width * c.channels:
+                raise ValueError(f"Raw frame must be {c.height * c.width * c.channels} bytes, got {buf.size}")
+            return buf.reshape(shape)
+
+        # Для порога достаточно яркости
+        flags = cv2.IMREAD_GRAYSCALE if self.config.operation == "threshold" else cv2.IMREAD_COLOR
+        frame = cv2.imdecode(buf, flags)
+        if frame is None:
+            raise ValueError("Cannot decode frame")
+        if frame.shape[0] * frame.shape[1] > MAX_IMAGE_PIXELS:
+            raise ValueError("Frame too large")
+        return frame
+
+    def process(self, frame: np.ndarray) -> np.ndarray:
+        """Обработка кадра (результат может указывать на рабочий буфер)"""
+        if self.lut is not None:
+            return cv2.LUT(frame, self.lut, dst=self._buffer("out", frame.shape))
+
+        if self.config.operation == "threshold" and self.params.method in ("otsu", "adaptive_mean", "adaptive_gaussian"):
+            if frame.ndim == 2:
+                gray = frame
+            else:
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self._buffer("gray", frame.shape[:2]))
+            out = self._buffer("out", gray.shape)
+
+            if self.params.method == "otsu":
+                cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=out)
+            else:
+                block_size = self.params.block_size | 1
+                mode = (cv2.ADAPTIVE_THRESH_MEAN_C if self.params.method == "adaptive_mean"
+                        else cv2.ADAPTIVE_THRESH_GAUSSIAN_C)
+                cv2.adaptiveThreshold(gray, 255, mode, cv2.THRESH_BINARY,
+                                      block_size, self.params.c_constant, dst=out)
+            return out
+
+        result, _ = apply_operation(frame, self.config.operation, self.config.params)
+        return result
+
+    def encode(self, image: np.ndarray) -> bytes:
+        if self._encode_ext is None:
+            return image.tobytes()
+        ok, encoded = cv2.imencode(self._encode_ext, image, self._encode_params)
+        if not ok:
+            raise ValueError("Frame encoding failed")
+        return encoded.tobytes()
+
+    def handle(self, data: bytes) -> tuple[bytes, dict]:
+        """Полный цикл для одного кадра со временем каждого этапа"""
+        t0 = time.perf_counter()
+        frame = self.decode(data)
+        t1 = time.perf_counter()
+        result = self.process(frame)
+        t2 = time.perf_counter()
+        payload = self.encode(result)
+        t3 = time.perf_counter()
+        return payload, {
+            "width": result.shape[1],
+            "height": result.shape[0],
+            "channels": 1 if result.ndim == 2 else result.shape[2],
+            "decode_ms": round((t1 - t0) * 1000, 3),
+            "process_ms": round((t2 - t1) * 1000, 3),
+            "encode_ms": round((t3 - t2) * 1000, 3),
+        }
+
+
 # ============= API ENDPOINTS =============
 
 @app.get("/")
 async def read_root():
     """Главная страница приложения"""
-    return FileResponse("static/index.html")
+    return FileResponse(os.path.join(STATIC_DIR, "index.html"))
 
 
 @app.post("/api/threshold")
@@ -349,25 +1559,39 @@ async def apply_threshold(
     method: str = "otsu",
     block_size: int = 11,
     c_constant: float = 2.0,
-    k_niblack: float = -0.2
+    k_niblack: float = -0.2,
+    n_thresholds: int = 2
 ):
     """
     Применение пороговой обработки к изображению
     
     Методы:
     - otsu: Метод Оцу (автоматический порог)
+    - otsu_multilevel: Многоуровневый Оцу (n_thresholds порогов, 1-5)
     - adaptive_mean: Адаптивный порог (среднее)
     - adaptive_gaussian: Адаптивный порог (Гаусс)
     - niblack: Метод Niblack (локальный порог)
     """
     try:
-        # Загружаем изображение
-        contents = await file.read()
-        image = load_image_from_upload(contents)
+        key = result_cache_key(file.file, "threshold", {
+            "method": method, "block_size": block_size, "c_constant": c_constant,
+            "k_niblack": k_niblack, "n_thresholds": n_thresholds
+        })
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached_json_response(cached, hit=True)
+        
+        # Загружаем изображение (для порога достаточно яркости)
+        image = load_image_from_upload(file.file, gray=True)
         
         # Применяем выбранный метод
+        extra = {}
         if method == "otsu":
             result = threshold_otsu(image)
+        elif method == "otsu_multilevel":
+            if not 1 <= n_thresholds <= 5:
+                raise HTTPException(status_code=400, detail="n_thresholds must be in 1..5")
+            result, extra["thresholds"] = threshold_otsu_multilevel(image, n_thresholds)
         elif method == "adaptive_mean":
             result = threshold_adaptive_mean(image, block_size, c_constant)
         elif method == "adaptive_gaussian":
@@ -381,14 +1605,152 @@ async def apply_threshold(
         hist_original = calculate_histogram(image)
         hist_result = calculate_histogram(result)
         
-        return JSONResponse({
+        return store_json_response(key, {
             "original": image_to_base64(image),
             "result": image_to_base64(result),
             "histogram_original": hist_original,
             "histogram_result": hist_result,
-            "method": method
+            "method": method,
+            **extra
         })
     
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/threshold/compare")
+async def compare_threshold_methods(
+    file: UploadFile = File(...),
+    methods: str = ",".join(THRESHOLD_METHODS),
+    block_size: int = 11,
+    c_constant: float = 2.0,
+    k_niblack: float = -0.2,
+    packed: bool = False,
+    parallel: bool = False
+):
+    """
+    Сравнение нескольких методов пороговой обработки за один запрос
+
+    - methods: список методов через запятую (otsu, adaptive_mean,
+      adaptive_gaussian, niblack)
+    - packed: результаты в 1-битном PNG вместо 8-битного
+    - parallel: выполнять методы параллельно в пуле потоков
+
+    Яркость вычисляется один раз, размытия общие для всех методов,
+    результаты одноканальные.
+    """
+    try:
+        selected = [m.strip() for m in methods.split(",") if m.strip()]
+        unknown = [m for m in selected if m not in THRESHOLD_METHODS]
+        if not selected or unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown threshold methods: {unknown}")
+        if block_size < 3:
+            raise HTTPException(status_code=400, detail="block_size must be >= 3")
+        # Повторы не пересчитываем
+        selected = list(dict.fromkeys(selected))
+
+        image = load_image_from_upload(file.file, gray=True)
+        results = compare_thresholds(image, selected, block_size, c_constant,
+                                     k_niblack, parallel)
+
+        return JSONResponse({
+            "original": image_to_base64(image),
+            "histogram_original": calculate_histogram(image),
+            "results": {
+                method: {
+                    "result": binary_to_base64(r["binary"], packed),
+                    "threshold": r["threshold"],
+                    "foreground_ratio": cv2.countNonZero(r["binary"]) / r["binary"].size,
+                    "time_ms": round(r["time_ms"], 3)
+                }
+                for method, r in results.items()
+            },
+            "block_size": block_size,
+            "c_constant": c_constant,
+            "k_niblack": k_niblack
+        })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def parse_number_list(text: str, name: str, cast=float) -> list:
+    """Разбор списка чисел через запятую (повторы удаляются)"""
+    try:
+        values = [cast(v) for v in text.split(",") if v.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name}: expected comma-separated numbers")
+    if not values:
+        raise HTTPException(status_code=400, detail=f"{name}: empty list")
+    return list(dict.fromkeys(values))
+
+
+@app.post("/api/threshold/sweep")
+async def sweep_threshold_parameters(
+    file: UploadFile = File(...),
+    methods: str = ",".join(SWEEP_METHODS),
+    block_sizes: str = "11,21,31",
+    c_values: str = "0,2,5,10",
+    k_values: str = "-0.5,-0.3,-0.2,0",
+    thumb_size: int = 200
+):
+    """
+    Подбор параметров адаптивных методов за один запрос
+
+    - methods: adaptive_mean, adaptive_gaussian, niblack (через запятую)
+    - block_sizes: размеры окна (четные увеличиваются до нечетных)
+    - c_values: значения C для adaptive_mean/adaptive_gaussian
+    - k_values: значения k для niblack
+    - thumb_size: размер миниатюры в мозаике (большая сторона)
+
+    Возвращает мозаику миниатюр (строка - метод и block_size,
+    столбец - C или k) и статистику по каждой комбинации.
+    """
+    try:
+        selected = list(dict.fromkeys(m.strip() for m in methods.split(",") if m.strip()))
+        unknown = [m for m in selected if m not in SWEEP_METHODS]
+        if not selected or unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown sweep methods: {unknown}")
+
+        sizes = list(dict.fromkeys(b | 1 for b in parse_number_list(block_sizes, "block_sizes", int)))
+        if min(sizes) < 3:
+            raise HTTPException(status_code=400, detail="block_sizes must be >= 3")
+        cs = parse_number_list(c_values, "c_values")
+        ks = parse_number_list(k_values, "k_values")
+        if not 16 <= thumb_size <= 1024:
+            raise HTTPException(status_code=400, detail="thumb_size must be in 16..1024")
+
+        combinations = sum(len(sizes) * (len(ks) if m == "niblack" else len(cs)) for m in selected)
+        if combinations > SWEEP_MAX_COMBINATIONS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Too many combinations: {combinations}, limit {SWEEP_MAX_COMBINATIONS}"
+            )
+
+        image = load_image_from_upload(file.file, gray=True)
+        start = time.perf_counter()
+        mosaic, (tile_w, tile_h), results, shared = sweep_thresholds(image, selected, sizes, cs, ks,
+                                                                     thumb_size)
+        total_ms = (time.perf_counter() - start) * 1000
+
+        return JSONResponse({
+            "mosaic": image_to_base64(mosaic),
+            "tile_width": tile_w,
+            "tile_height": tile_h,
+            "rows": [{"method": m, "block_size": b} for m in selected for b in sizes],
+            "c_values": cs,
+            "k_values": ks,
+            "results": results,
+            "shared": shared,
+            "total_ms": round(total_ms, 3)
+        })
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -407,15 +1769,19 @@ async def apply_contrast(
     - beta: смещение яркости (-100 - 100)
     """
     try:
-        contents = await file.read()
-        image = load_image_from_upload(contents)
+        key = result_cache_key(file.file, "contrast", {"alpha": alpha, "beta": beta})
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached_json_response(cached, hit=True)
+        
+        image = load_image_from_upload(file.file)
         
         result = linear_contrast(image, alpha, beta)
         
         hist_original = calculate_histogram(image)
         hist_result = calculate_histogram(result)
         
-        return JSONResponse({
+        return store_json_response(key, {
             "original": image_to_base64(image),
             "result": image_to_base64(result),
             "histogram_original": hist_original,
@@ -424,6 +1790,8 @@ async def apply_contrast(
             "beta": beta
         })
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -444,15 +1812,19 @@ async def apply_arithmetic(
     - divide: деление
     """
     try:
-        contents = await file.read()
-        image = load_image_from_upload(contents)
+        key = result_cache_key(file.file, "arithmetic", {"operation": operation, "value": value})
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached_json_response(cached, hit=True)
+        
+        image = load_image_from_upload(file.file)
         
         result = arithmetic_operation(image, operation, value)
         
         hist_original = calculate_histogram(image)
         hist_result = calculate_histogram(result)
         
-        return JSONResponse({
+        return store_json_response(key, {
             "original": image_to_base64(image),
             "result": image_to_base64(result),
             "histogram_original": hist_original,
@@ -461,6 +1833,173 @@ async def apply_arithmetic(
             "value": value
         })
     
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/histogram-matching/reference")
+async def upload_matching_reference(file: UploadFile = File(...)):
+    """
+    Загрузка эталона для приведения гистограмм
+
+    Идентификатор - хэш содержимого файла, поэтому повторная загрузка
+    того же эталона не пересчитывает его CDF.
+    """
+    try:
+        check_upload_size(file.file)
+        reference_id = upload_digest(file.file)
+        entry = _references.get(reference_id)
+        if entry is None:
+            entry = register_reference(load_image_from_upload(file.file), reference_id)
+
+        return JSONResponse({
+            "reference_id": reference_id,
+            "width": entry["width"],
+            "height": entry["height"],
+            "histogram": entry["histogram"]
+        })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/histogram-matching")
+async def apply_histogram_matching(
+    file: UploadFile = File(...),
+    reference_id: str = "",
+    method: str = "rgb"
+):
+    """
+    Приведение гистограммы к загруженному эталону
+
+    Методы:
+    - rgb: по каждому каналу отдельно
+    - hsv_v: только яркость V
+    - hls_l: только светлота L
+    """
+    try:
+        params = HistogramMatchParams(reference_id=reference_id, method=method)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    reference = _references.get(reference_id)
+    if reference is None:
+        raise HTTPException(status_code=404, detail="Reference not found")
+    _references.move_to_end(reference_id)
+
+    try:
+        key = result_cache_key(file.file, "histogram-matching", params.model_dump())
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached_json_response(cached, hit=True)
+
+        image = load_image_from_upload(file.file)
+        result = histogram_matching(image, reference["cdfs"], params.method)
+
+        return store_json_response(key, {
+            "original": image_to_base64(image),
+            "result": image_to_base64(result),
+            "histogram_original": calculate_histogram(image),
+            "histogram_result": calculate_histogram(result),
+            "histogram_reference": reference["histogram"],
+            **params.model_dump()
+        })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/combine")
+async def combine_two_images(
+    second: UploadFile = File(...),
+    file: Optional[UploadFile] = File(None),
+    session_id: Optional[str] = None,
+    operation: str = "absdiff",
+    alpha: float = 0.5,
+    align: str = "resize",
+    scope: str = "full"
+):
+    """
+    Операции над двумя изображениями
+
+    Операции: add, subtract, absdiff, multiply, blend, min, max.
+    Второе изображение приводится к первому (align: resize, crop, pad).
+
+    Первое изображение - загруженный file или уже хранящаяся на сервере
+    сессия предпросмотра (session_id), тогда большой скан не загружается
+    повторно:
+    - scope=preview: уменьшенная копия сессии, второе изображение
+      декодируется сразу в ее размере; копия остается неизменной,
+      результат пишется в новый буфер
+    - scope=full: исходные байты сессии декодируются в полном разрешении
+    В остальных случаях результат вычисляется на месте в буфере
+    только что декодированного первого изображения.
+    """
+    try:
+        params = CombineParams(operation=operation, alpha=alpha, align=align, scope=scope)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if (file is None) == (session_id is None):
+        raise HTTPException(status_code=400, detail="Pass either file or session_id")
+    session = get_preview_session(session_id) if session_id is not None else None
+
+    try:
+        key_params = {**params.model_dump(), "second": upload_digest(second.file)}
+        if session is not None:
+            key = digest_cache_key(session["digest"], "combine", key_params)
+        else:
+            key_params.pop("scope")
+            key = result_cache_key(file.file, "combine", key_params)
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached_json_response(cached, hit=True)
+
+        in_place = True
+        if session is None:
+            base = load_image_from_upload(file.file)
+        elif params.scope == "preview":
+            # Кэшированную копию не портим: она нужна следующим render
+            base, in_place = session["proxy"], False
+        else:
+            base = load_image_from_upload(session["data"])
+
+        if session is not None and params.scope == "preview":
+            second.file.seek(0)
+            other, _, _ = load_preview_from_upload(second.file.read(), max(base.shape[:2]))
+        else:
+            other = load_image_from_upload(second.file)
+        first, other = align_images(base, other, params.align)
+
+        # Исходные изображения кодируются до операции: дальше буфер first перезаписывается
+        payload = {
+            "original": image_to_base64(first),
+            "second": image_to_base64(other),
+            "histogram_original": calculate_histogram(first),
+        }
+        result = combine_images(first, other, params.operation, params.alpha,
+                                out=first if in_place else None)
+
+        extra = {}
+        if session is not None:
+            extra = {"session_id": session_id, "preview": params.scope == "preview",
+                     "scale": session["scale"] if params.scope == "preview" else 1.0}
+        return store_json_response(key, {
+            **payload,
+            "result": image_to_base64(result),
+            "histogram_result": calculate_histogram(result),
+            **params.model_dump(exclude={"scope"}),
+            **extra,
+            "width": result.shape[1],
+            "height": result.shape[0]
+        })
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -479,8 +2018,12 @@ async def apply_histogram_equalization(
     - hls_l: эквализация только светлоты L в HLS
     """
     try:
-        contents = await file.read()
-        image = load_image_from_upload(contents)
+        key = result_cache_key(file.file, "histogram-equalization", {"method": method})
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached_json_response(cached, hit=True)
+        
+        image = load_image_from_upload(file.file)
         
         if method == "rgb":
             result = histogram_equalization_rgb(image)
@@ -494,7 +2037,7 @@ async def apply_histogram_equalization(
         hist_original = calculate_histogram(image)
         hist_result = calculate_histogram(result)
         
-        return JSONResponse({
+        return store_json_response(key, {
             "original": image_to_base64(image),
             "result": image_to_base64(result),
             "histogram_original": hist_original,
@@ -502,12 +2045,293 @@ async def apply_histogram_equalization(
             "method": method
         })
     
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """Метрики кэша результатов (попадания, промахи, вытеснения, объем)"""
+    return JSONResponse(result_cache.stats())
+
+
+@app.post("/api/preview")
+async def create_preview(
+    file: UploadFile = File(...),
+    max_dim: int = PREVIEW_MAX_DIM
+):
+    """
+    Создание сессии предпросмотра
+
+    Изображение декодируется в уменьшенном разрешении (не больше max_dim
+    по большей стороне) и кэшируется вместе с исходными байтами.
+    Дальнейшие запросы render работают с уменьшенной копией,
+    а commit - с полным разрешением без повторной загрузки файла.
+    """
+    try:
+        check_upload_size(file.file)
+        contents = await file.read()
+        proxy, scale, (full_w, full_h) = load_preview_from_upload(contents, max(64, max_dim))
+
+        session_id = uuid.uuid4().hex
+        store_preview_session(session_id, {
+            "data": contents,
+            "digest": upload_digest(io.BytesIO(contents)),
+            "proxy": proxy,
+            "scale": scale,
+            "full_size": (full_w, full_h),
+        })
+
+        return JSONResponse({
+            "session_id": session_id,
+            "scale": scale,
+            "width": full_w,
+            "height": full_h,
+            "preview_width": proxy.shape[1],
+            "preview_height": proxy.shape[0]
+        })
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/preview/{session_id}/render")
+async def render_preview(session_id: str, request: OperationRequest):
+    """
+    Быстрая обработка уменьшенной копии
+
+    Локальные параметры (block_size) масштабируются вместе с изображением,
+    поэтому предпросмотр соответствует финальному результату.
+    Для threshold исходное изображение возвращается в оттенках серого,
+    как в /api/threshold и commit.
+    """
+    session = get_preview_session(session_id)
+    image = session["proxy"]
+    if request.operation == "threshold":
+        image = to_grayscale(image)
+    try:
+        result, params = apply_operation(image, request.operation,
+                                         request.params, session["scale"])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return make_result_response(image, result, **params,
+                                preview=True, scale=session["scale"])
+
+
+@app.post("/api/preview/{session_id}/commit")
+async def commit_preview(session_id: str, request: OperationRequest):
+    """
+    Финальная обработка в полном разрешении
+
+    Для threshold изображение декодируется сразу в оттенках серого -
+    так же, как в /api/threshold, поэтому original и histogram_original
+    не зависят от того, включен ли предпросмотр.
+    """
+    session = get_preview_session(session_id)
+    try:
+        image = load_image_from_upload(session["data"], gray=request.operation == "threshold")
+        result, params = apply_operation(image, request.operation, request.params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return make_result_response(image, result, **params,
+                                preview=False, scale=1.0)
+
+
+@app.post("/api/jobs", status_code=202)
+async def submit_job(
+    file: UploadFile = File(...),
+    pipeline: str = '[{"operation": "threshold", "params": {"method": "otsu"}}]'
+):
+    """
+    Постановка обработки в очередь (для больших изображений)
+
+    pipeline - JSON-список шагов вида {"operation": ..., "params": {...}},
+    применяемых последовательно. Ответ возвращается сразу с job_id;
+    статус - GET /api/jobs/{job_id}, результат (PNG) -
+    GET /api/jobs/{job_id}/result.
+    """
+    try:
+        steps = _pipeline_adapter.validate_json(pipeline)
+        for step in steps:
+            OPERATION_PARAMS[step.operation](**step.params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not steps:
+        raise HTTPException(status_code=400, detail="Empty pipeline")
+
+    # Проверяем размеры до постановки в очередь
+    check_upload_size(file.file)
+    open_image_header(file.file)
+    await file.seek(0)
+    data = await file.read()
+
+    with _jobs_lock:
+        purge_jobs()
+        if len(_jobs) >= JOB_MAX_STORED:
+            # Освобождаем место за счет самых старых готовых задач
+            finished = [job_id for job_id, job in _jobs.items() if job["finished_at"] is not None]
+            for job_id in finished[:len(_jobs) - JOB_MAX_STORED + 1]:
+                del _jobs[job_id]
+        if len(_jobs) >= JOB_MAX_STORED:
+            raise HTTPException(status_code=503, detail="Job queue is full")
+
+        job_id = uuid.uuid4().hex
+        _jobs[job_id] = {
+            "job_id": job_id,
+            "status": "queued",
+            "steps": ["decode", *(step.operation for step in steps), "encode"],
+            "total_steps": len(steps) + 2,
+            "completed_steps": 0,
+            "current_step": None,
+            "width": None,
+            "height": None,
+            "error": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "expires_at": None,
+            "result": None,
+            "future": None,
+        }
+        _jobs[job_id]["future"] = _job_executor.submit(run_job, job_id, data, steps)
+
+    return JSONResponse({"job_id": job_id, "status": "queued"}, status_code=202)
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """Статус и прогресс задачи"""
+    with _jobs_lock:
+        purge_jobs()
+        job = _jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return JSONResponse(job_status(job))
+
+
+@app.get("/api/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """Результат задачи в формате PNG"""
+    with _jobs_lock:
+        purge_jobs()
+        job = _jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        status, error, result = job["status"], job["error"], job["result"]
+
+    if status == "failed":
+        raise HTTPException(status_code=500, detail=error)
+    if status != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {status}")
+    return Response(content=result, media_type="image/png")
+
+
+@app.delete("/api/jobs/{job_id}")
+async def delete_job(job_id: str):
+    """Отмена задачи в очереди или удаление результата"""
+    with _jobs_lock:
+        job = _jobs.pop(job_id, None)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    # Выполняющуюся задачу прервать нельзя, ее результат просто не сохранится
+    cancelled = job["future"].cancel()
+    return JSONResponse({"job_id": job_id, "cancelled": cancelled})
+
+
+@app.websocket("/ws/stream")
+async def stream_frames(websocket: WebSocket):
+    """
+    Потоковая обработка кадров (веб-камера, видео)
+
+    Протокол:
+    1. Клиент отправляет текстовое сообщение с JSON-конфигурацией
+       (StreamConfig: operation, params, input, output, ...).
+       Новая конфигурация может быть отправлена в любой момент.
+    2. Каждый кадр - бинарное сообщение (JPEG/PNG или сырые байты).
+    3. Сервер отвечает бинарным сообщением с обработанным кадром
+       и текстовым JSON со статистикой (время этапов, задержка, пропуски).
+
+    Если клиент присылает кадры быстрее, чем они обрабатываются,
+    обрабатывается только последний, остальные отбрасываются.
+    """
+    await websocket.accept()
+    state = {"processor": None, "latest": None, "received": 0, "dropped": 0, "closed": False}
+    frame_ready = asyncio.Event()
+
+    async def receive_loop():
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("text") is not None:
+                    try:
+                        config = StreamConfig.model_validate_json(message["text"])
+                        state["processor"] = FrameProcessor(config)
+                        await websocket.send_json({"type": "config", "ok": True})
+                    except ValueError as e:
+                        await websocket.send_json({"type": "error", "detail": str(e)})
+                elif message.get("bytes") is not None:
+                    state["received"] += 1
+                    if state["latest"] is not None:
+                        state["dropped"] += 1
+                    state["latest"] = (state["received"], message["bytes"], time.perf_counter())
+                    frame_ready.set()
+        finally:
+            state["closed"] = True
+            frame_ready.set()
+
+    async def process_loop():
+        while True:
+            await frame_ready.wait()
+            frame_ready.clear()
+            if state["closed"]:
+                return
+            if state["latest"] is None:
+                continue
+            seq, data, received_at = state["latest"]
+            state["latest"] = None
+
+            processor = state["processor"]
+            if processor is None:
+                await websocket.send_json({"type": "error", "frame": seq, "detail": "Send configuration first"})
+                continue
+
+            started_at = time.perf_counter()
+            try:
+                payload, stats = await asyncio.to_thread(processor.handle, data)
+            except Exception as e:
+                await websocket.send_json({"type": "error", "frame": seq, "detail": str(e)})
+                continue
+
+            await websocket.send_bytes(payload)
+            await websocket.send_json({
+                "type": "frame",
+                "frame": seq,
+                **stats,
+                "queue_ms": round((started_at - received_at) * 1000, 3),
+                "latency_ms": round((time.perf_counter() - received_at) * 1000, 3),
+                "dropped": state["dropped"],
+            })
+
+    receiver = asyncio.create_task(receive_loop())
+    try:
+        await process_loop()
+    except (WebSocketDisconnect, RuntimeError):
+        # Клиент отключился во время отправки
+        pass
+    finally:
+        receiver.cancel()
+
+
 # Монтируем статические файлы
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
 
 if __name__ == "__main__":
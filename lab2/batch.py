@@ -0,0 +1,317 @@
+"""
+Пакетная обработка каталогов изображений операциями лабораторной №2
+
+Примеры:
+    python batch.py scans/ out/ --op threshold:method=niblack,block_size=25
+    python batch.py scans/ out/ --op histogram-equalization:method=hls_l \\
+        --op contrast:alpha=1.3,beta=-10 --workers 8 --format jpg
+    python batch.py scans/ out/ --op histogram-matching:method=hsv_v --reference ref.jpg
+
+Операции из нескольких --op применяются последовательно (цепочка).
+Файлы обходятся лениво, в обработке одновременно находится не более
+нескольких изображений на процесс. Уже обработанные файлы (результат
+новее исходника) пропускаются, поэтому прерванный запуск можно продолжить.
+Цепочка операций и формат записываются в output_dir/.batch-pipeline.json:
+при запуске с другой цепочкой все файлы обрабатываются заново.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cv2
+from fastapi import HTTPException
+
+from app import (OPERATION_PARAMS, apply_operation, load_image_from_upload,
+                 register_reference, upload_digest)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp", ".avif"}
+OUTPUT_FORMATS = {"png": ".png", "jpg": ".jpg", "webp": ".webp", "tiff": ".tiff"}
+
+# Сколько задач держать в очереди на один процесс
+TASKS_PER_WORKER = 2
+
+# Описание цепочки, которой получены результаты в каталоге
+PIPELINE_MARKER = ".batch-pipeline.json"
+
+
+def parse_operation(spec: str) -> tuple[str, dict]:
+    """
+    Разбор описания операции вида "имя:ключ=значение,ключ=значение"
+
+    Значения передаются строками, типы приводит pydantic-модель операции.
+    """
+    name, _, args = spec.partition(":")
+    name = name.strip()
+    if name not in OPERATION_PARAMS:
+        raise argparse.ArgumentTypeError(
+            f"unknown operation '{name}', expected one of: {', '.join(OPERATION_PARAMS)}"
+        )
+
+    params = {}
+    for item in filter(None, (a.strip() for a in args.split(","))):
+        key, sep, value = item.partition("=")
+        if not sep:
+            raise argparse.ArgumentTypeError(f"bad parameter '{item}' in '{spec}'")
+        params[key.strip()] = value.strip()
+
+    # Проверяем параметры до запуска пула, а не на первом файле
+    try:
+        OPERATION_PARAMS[name](**params)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"{spec}: {e}")
+    return name, params
+
+
+def iter_images(input_dir: str, skip_dir: str = None):
+    """Ленивый обход дерева каталогов (в порядке имен)"""
+    skip_dir = os.path.abspath(skip_dir) if skip_dir else None
+    for root, dirs, files in os.walk(input_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.abspath(os.path.join(root, d)) != skip_dir)
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                yield os.path.join(root, name)
+
+
+def output_path_for(path: str, input_dir: str, output_dir: str, extension: str) -> str:
+    """
+    Путь результата: та же структура каталогов, к имени добавляется
+    расширение формата (scan.jpg -> scan.jpg.png), чтобы scan.jpg
+    и scan.tif не перезаписывали друг друга
+    """
+    relative = os.path.relpath(path, input_dir)
+    return os.path.join(output_dir, relative + extension)
+
+
+def is_done(src: str, dst: str, since: float = 0.0) -> bool:
+    """
+    Результат уже существует, не старше исходного файла
+    и записан не раньше since (начала работы текущей цепочки)
+    """
+    try:
+        return os.path.getmtime(dst) >= max(os.path.getmtime(src), since)
+    except OSError:
+        return False
+
+
+def pipeline_fingerprint(pipeline: list, extension: str, quality: int) -> str:
+    """
+    Отпечаток цепочки операций и формата результата
+
+    Параметры нормализуются pydantic-моделью, поэтому alpha=1.30
+    и alpha=1.3 дают один отпечаток.
+    """
+    canonical = json.dumps(
+        {
+            "ops": [[name, OPERATION_PARAMS[name](**params).model_dump()] for name, params in pipeline],
+            "extension": extension,
+            "quality": quality,
+        },
+        sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+
+def claim_output_dir(output_dir: str, fingerprint: str, overwrite: bool) -> float:
+    """
+    Запись отпечатка цепочки в каталог результатов
+
+    Возвращает момент, с которого результаты считаются полученными этой
+    цепочкой. Если цепочка совпадает с записанной, это сохраненный момент
+    (прерванный запуск продолжается). Иначе - текущее время: все файлы,
+    включая оставшиеся от прежней цепочки, будут обработаны заново, и это
+    переживает повторное прерывание.
+    """
+    marker = os.path.join(output_dir, PIPELINE_MARKER)
+    if not overwrite:
+        try:
+            with open(marker, encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("fingerprint") == fingerprint:
+                return float(state["since"])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    since = time.time()
+    os.makedirs(output_dir, exist_ok=True)
+    tmp = f"{marker}.{os.getpid()}.partial"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"fingerprint": fingerprint, "since": since}, f)
+    os.replace(tmp, marker)
+    return since
+
+
+def init_worker(reference: tuple = None):
+    """
+    Один поток OpenCV на процесс - параллелизм дает сам пул
+
+    reference - (путь, идентификатор) эталона для histogram-matching;
+    его CDF вычисляются один раз на процесс.
+    """
+    cv2.setNumThreads(1)
+    if reference is not None:
+        path, reference_id = reference
+        with open(path, "rb") as f:
+            register_reference(load_image_from_upload(f), reference_id)
+
+
+def process_file(src: str, dst: str, pipeline: list, extension: str, quality: int) -> int:
+    """
+    Обработка одного файла в процессе пула
+
+    Результат сначала пишется во временный файл и затем атомарно
+    переименовывается, так что прерванная запись не считается готовой.
+    Возвращает число пикселей исходного изображения.
+
+    HTTPException (пустой, поврежденный или слишком большой файл)
+    не восстанавливается при передаче из процесса пула и ломает весь пул,
+    поэтому заменяется на RuntimeError - файл считается неудачным.
+    """
+    # Если цепочка начинается с порога, цвет не нужен
+    gray = pipeline[0][0] == "threshold"
+    try:
+        with open(src, "rb") as f:
+            image = load_image_from_upload(f, gray=gray)
+        pixels = image.shape[0] * image.shape[1]
+
+        for operation, params in pipeline:
+            image, _ = apply_operation(image, operation, params)
+    except HTTPException as e:
+        raise RuntimeError(f"{e.status_code}: {e.detail}") from None
+
+    if extension == ".jpg":
+        encode_params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    elif extension == ".webp":
+        encode_params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    else:
+        encode_params = []
+    ok, encoded = cv2.imencode(extension, image, encode_params)
+    if not ok:
+        raise RuntimeError(f"cannot encode {extension}")
+
+    os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+    tmp = f"{dst}.{os.getpid()}.partial"
+    with open(tmp, "wb") as f:
+        f.write(encoded.tobytes())
+    os.replace(tmp, dst)
+    return pixels
+
+
+def format_rate(count: int, megapixels: float, elapsed: float) -> str:
+    elapsed = max(elapsed, 1e-9)
+    return f"{count / elapsed:.2f} img/s, {megapixels / elapsed:.2f} MP/s"
+
+
+def run(args) -> int:
+    extension = OUTPUT_FORMATS[args.format]
+    workers = args.workers or os.cpu_count() or 1
+    max_pending = workers * TASKS_PER_WORKER
+
+    processed = skipped = failed = 0
+    megapixels = 0.0
+    start = last_report = time.perf_counter()
+
+    def report(final: bool = False):
+        elapsed = time.perf_counter() - start
+        prefix = "done" if final else "progress"
+        print(f"[{prefix}] processed={processed} skipped={skipped} failed={failed} "
+              f"elapsed={elapsed:.1f}s {format_rate(processed, megapixels, elapsed)}",
+              file=sys.stderr)
+
+    def collect(done):
+        nonlocal processed, failed, megapixels
+        for future in done:
+            src = pending.pop(future)
+            try:
+                megapixels += future.result() / 1e6
+                processed += 1
+            except Exception as e:
+                failed += 1
+                print(f"error: {src}: {e}", file=sys.stderr)
+
+    reference = None
+    if args.reference:
+        # Проверяем эталон заранее: ошибка в инициализаторе ломает пул
+        try:
+            with open(args.reference, "rb") as f:
+                load_image_from_upload(f)
+                reference = (args.reference, upload_digest(f))
+        except HTTPException as e:
+            print(f"error: {args.reference}: {e.status_code}: {e.detail}", file=sys.stderr)
+            return 2
+        except OSError as e:
+            print(f"error: {e}", file=sys.stderr)
+            return 2
+        for operation, params in args.op:
+            if operation == "histogram-matching":
+                params.setdefault("reference_id", reference[1])
+
+    fingerprint = pipeline_fingerprint(args.op, extension, args.quality)
+    since = claim_output_dir(args.output_dir, fingerprint, args.overwrite)
+
+    pending = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(reference,)) as pool:
+        for src in iter_images(args.input_dir, skip_dir=args.output_dir):
+            dst = output_path_for(src, args.input_dir, args.output_dir, extension)
+            if not args.overwrite and is_done(src, dst, since):
+                skipped += 1
+                continue
+
+            # Ограничиваем число задач в полете: список файлов не копится в памяти
+            while len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+
+            future = pool.submit(process_file, src, dst, args.op, extension, args.quality)
+            pending[future] = src
+
+            now = time.perf_counter()
+            if now - last_report >= args.report_interval:
+                report()
+                last_report = now
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+
+    report(final=True)
+    return 1 if failed else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Пакетная обработка изображений операциями лабораторной №2"
+    )
+    parser.add_argument("input_dir", help="каталог с исходными изображениями (обходится рекурсивно)")
+    parser.add_argument("output_dir", help="каталог для результатов (структура сохраняется)")
+    parser.add_argument("--op", action="append", type=parse_operation, required=True,
+                        metavar="NAME[:key=value,...]",
+                        help="операция: threshold, contrast, arithmetic, histogram-equalization, "
+                             "histogram-matching; "
+                             "можно указать несколько раз для цепочки")
+    parser.add_argument("--reference",
+                        help="эталонное изображение для histogram-matching")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="число процессов (по умолчанию - число ядер)")
+    parser.add_argument("--format", choices=sorted(OUTPUT_FORMATS), default="png",
+                        help="формат результатов (по умолчанию png)")
+    parser.add_argument("--quality", type=int, default=95, help="качество для jpg/webp")
+    parser.add_argument("--overwrite", action="store_true",
+                        help="обрабатывать заново уже существующие результаты")
+    parser.add_argument("--report-interval", type=float, default=10.0,
+                        help="период вывода прогресса, секунды")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.input_dir):
+        parser.error(f"not a directory: {args.input_dir}")
+    if any(op == "histogram-matching" for op, _ in args.op) and not args.reference:
+        parser.error("histogram-matching requires --reference")
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,6 +3,14 @@ let currentImage = null;
 let currentTab = 'threshold';
 let originalHistogramChart = null;
 let resultHistogramChart = null;
+let previewSessionId = null;
+let previewTimer = null;
+let previewRequestId = 0;
+
+// Задержка перед запросом предпросмотра при движении слайдера (мс)
+const PREVIEW_DEBOUNCE_MS = 150;
+// Максимальный размер уменьшенной копии (большая сторона, px)
+const PREVIEW_MAX_DIM = 1024;
 
 // Инициализация при загрузке
 document.addEventListener('DOMContentLoaded', () => {
@@ -21,36 +29,70 @@ function setupEventListeners() {
     });
     
     // Пороговая обработка
-    document.getElementById('thresholdMethod').addEventListener('change', updateThresholdControls);
+    document.getElementById('thresholdMethod').addEventListener('change', () => {
+        updateThresholdControls();
+        schedulePreview('threshold');
+    });
+    document.getElementById('nThresholds').addEventListener('input', (e) => {
+        document.getElementById('nThresholdsValue').textContent = e.target.value;
+        schedulePreview('threshold');
+    });
     document.getElementById('blockSize').addEventListener('input', (e) => {
         document.getElementById('blockSizeValue').textContent = e.target.value;
+        schedulePreview('threshold');
     });
     document.getElementById('cConstant').addEventListener('input', (e) => {
         document.getElementById('cConstantValue').textContent = e.target.value;
+        schedulePreview('threshold');
     });
     document.getElementById('kNiblack').addEventListener('input', (e) => {
         document.getElementById('kNiblackValue').textContent = e.target.value;
+        schedulePreview('threshold');
     });
     document.getElementById('applyThreshold').addEventListener('click', applyThreshold);
+    document.getElementById('compareThresholds').addEventListener('click', compareThresholds);
+    document.getElementById('sweepThresholds').addEventListener('click', sweepThresholds);
     
     // Контрастирование
     document.getElementById('alpha').addEventListener('input', (e) => {
         document.getElementById('alphaValue').textContent = parseFloat(e.target.value).toFixed(1);
+        schedulePreview('contrast');
     });
     document.getElementById('beta').addEventListener('input', (e) => {
         document.getElementById('betaValue').textContent = e.target.value;
+        schedulePreview('contrast');
     });
     document.getElementById('applyContrast').addEventListener('click', applyContrast);
     
     // Поэлементные операции
     document.getElementById('operationValue').addEventListener('input', (e) => {
         document.getElementById('operationValueDisplay').textContent = e.target.value;
+        schedulePreview('arithmetic');
     });
+    document.getElementById('operation').addEventListener('change', () => schedulePreview('arithmetic'));
     document.getElementById('applyArithmetic').addEventListener('click', applyArithmetic);
+    document.getElementById('combineAlpha').addEventListener('input', (e) => {
+        document.getElementById('combineAlphaValue').textContent = e.target.value;
+    });
+    document.getElementById('applyCombine').addEventListener('click', applyCombine);
     
     // Эквализация гистограммы
-    document.getElementById('histMethod').addEventListener('change', updateHistogramDescription);
+    document.getElementById('histMethod').addEventListener('change', () => {
+        updateHistogramDescription();
+        schedulePreview('histogram');
+    });
     document.getElementById('applyHistogram').addEventListener('click', applyHistogramEqualization);
+    document.getElementById('referenceImage').addEventListener('change', () => { referenceId = null; });
+    document.getElementById('applyMatching').addEventListener('click', applyHistogramMatching);
+    
+    // Режим предпросмотра
+    document.getElementById('previewMode').addEventListener('change', (e) => {
+        if (e.target.checked && currentImage) {
+            createPreviewSession(currentImage);
+        } else {
+            previewSessionId = null;
+        }
+    });
     
     // Действия с результатом
     document.getElementById('downloadResult').addEventListener('click', downloadResult);
@@ -96,8 +138,13 @@ function handleImageUpload(event) {
     }
     
     currentImage = file;
+    previewSessionId = null;
     document.getElementById('fileName').textContent = `Загружено: ${file.name}`;
     
+    if (document.getElementById('previewMode').checked) {
+        createPreviewSession(file);
+    }
+    
     // Включаем кнопки применения
     enableApplyButtons();
 }
@@ -123,8 +170,11 @@ function updateThresholdControls() {
     const blockSizeGroup = document.getElementById('blockSizeGroup');
     const cConstantGroup = document.getElementById('cConstantGroup');
     const kNiblackGroup = document.getElementById('kNiblackGroup');
+    const nThresholdsGroup = document.getElementById('nThresholdsGroup');
     
-    if (method === 'otsu') {
+    nThresholdsGroup.style.display = method === 'otsu_multilevel' ? 'block' : 'none';
+    
+    if (method === 'otsu' || method === 'otsu_multilevel') {
         blockSizeGroup.style.display = 'none';
         cConstantGroup.style.display = 'none';
         kNiblackGroup.style.display = 'none';
@@ -160,22 +210,33 @@ async function applyThreshold() {
         return;
     }
     
+    if (previewSessionId) {
+        await commitPreview('threshold');
+        return;
+    }
+    
     const method = document.getElementById('thresholdMethod').value;
     const blockSize = parseInt(document.getElementById('blockSize').value);
     const cConstant = parseFloat(document.getElementById('cConstant').value);
     const kNiblack = parseFloat(document.getElementById('kNiblack').value);
+    const nThresholds = parseInt(document.getElementById('nThresholds').value);
+    
+    // Параметры метода передаются в строке запроса
+    const params = new URLSearchParams({
+        method: method,
+        block_size: blockSize,
+        c_constant: cConstant,
+        k_niblack: kNiblack,
+        n_thresholds: nThresholds
+    });
     
     const formData = new FormData();
     formData.append('file', currentImage);
-    formData.append('method', method);
-    formData.append('block_size', blockSize);
-    formData.append('c_constant', cConstant);
-    formData.append('k_niblack', kNiblack);
     
     showLoader();
     
     try {
-        const response = await fetch('/api/threshold', {
+        const response = await fetch(`/api/threshold?${params}`, {
             method: 'POST',
             body: formData
         });
@@ -192,6 +253,132 @@ async function applyThreshold() {
     }
 }
 
+// Сравнение всех методов пороговой обработки за один запрос
+async function compareThresholds() {
+    if (!currentImage) {
+        alert('Сначала загрузите изображение!');
+        return;
+    }
+    
+    const params = new URLSearchParams({
+        methods: 'otsu,adaptive_mean,adaptive_gaussian,niblack',
+        block_size: document.getElementById('blockSize').value,
+        c_constant: document.getElementById('cConstant').value,
+        k_niblack: document.getElementById('kNiblack').value,
+        packed: true,
+        parallel: true
+    });
+    
+    const formData = new FormData();
+    formData.append('file', currentImage);
+    
+    showLoader();
+    
+    try {
+        const response = await fetch(`/api/threshold/compare?${params}`, {
+            method: 'POST',
+            body: formData
+        });
+        
+        if (!response.ok) throw new Error('Ошибка обработки');
+        
+        const data = await response.json();
+        displayComparison(data);
+    } catch (error) {
+        console.error('Error:', error);
+        alert('Ошибка при обработке изображения: ' + error.message);
+    } finally {
+        hideLoader();
+    }
+}
+
+// Отображение результатов сравнения методов
+function displayComparison(data) {
+    const methodNames = {
+        'otsu': 'Метод Оцу (Otsu)',
+        'adaptive_mean': 'Адаптивный порог (среднее)',
+        'adaptive_gaussian': 'Адаптивный порог (Гаусс)',
+        'niblack': 'Метод Niblack'
+    };
+    
+    const grid = document.getElementById('compareGrid');
+    grid.innerHTML = '';
+    
+    Object.entries(data.results).forEach(([method, result]) => {
+        const box = document.createElement('div');
+        box.className = 'image-box';
+        
+        let html = `<h4>${methodNames[method]}</h4><img src="${result.result}" alt="${method}">`;
+        html += `<p><strong>Доля переднего плана:</strong> ${(result.foreground_ratio * 100).toFixed(1)}%</p>`;
+        html += `<p><strong>Время:</strong> ${result.time_ms.toFixed(1)} мс</p>`;
+        if (result.threshold !== null) {
+            html += `<p><strong>Порог:</strong> ${result.threshold}</p>`;
+        }
+        
+        box.innerHTML = html;
+        grid.appendChild(box);
+    });
+    
+    const section = document.getElementById('compareSection');
+    section.style.display = 'block';
+    section.scrollIntoView({ behavior: 'smooth' });
+}
+
+// Перебор параметров адаптивных методов (мозаика миниатюр)
+async function sweepThresholds() {
+    if (!currentImage) {
+        alert('Сначала загрузите изображение!');
+        return;
+    }
+    
+    const formData = new FormData();
+    formData.append('file', currentImage);
+    
+    showLoader();
+    
+    try {
+        const response = await fetch('/api/threshold/sweep', {
+            method: 'POST',
+            body: formData
+        });
+        
+        if (!response.ok) throw new Error('Ошибка обработки');
+        
+        const data = await response.json();
+        displaySweep(data);
+    } catch (error) {
+        console.error('Error:', error);
+        alert('Ошибка при обработке изображения: ' + error.message);
+    } finally {
+        hideLoader();
+    }
+}
+
+// Отображение мозаики: строка - метод и размер блока, столбец - C или k
+function displaySweep(data) {
+    const grid = document.getElementById('compareGrid');
+    grid.innerHTML = '';
+    
+    const box = document.createElement('div');
+    box.className = 'image-box';
+    
+    const rows = data.rows.map(row => {
+        const values = row.method === 'niblack' ? data.k_values : data.c_values;
+        const label = row.method === 'niblack' ? 'k' : 'C';
+        return `<li>${row.method}, блок ${row.block_size}: ${label} = ${values.join(', ')}</li>`;
+    }).join('');
+    
+    box.innerHTML = `<h4>Подбор параметров (${data.results.length} вариантов)</h4>
+        <img src="${data.mosaic}" alt="sweep">
+        <ul>${rows}</ul>
+        <p><strong>Общее время:</strong> ${data.total_ms.toFixed(1)} мс</p>`;
+    grid.appendChild(box);
+    
+    const section = document.getElementById('compareSection');
+    section.style.display = 'block';
+    section.scrollIntoView({ behavior: 'smooth' });
+}
+
 // Применение контрастирования
 async function applyContrast() {
     if (!currentImage) {
@@ -199,6 +386,11 @@ async function applyContrast() {
         return;
     }
     
+    if (previewSessionId) {
+        await commitPreview('contrast');
+        return;
+    }
+    
     const alpha = parseFloat(document.getElementById('alpha').value);
     const beta = parseFloat(document.getElementById('beta').value);
     
@@ -234,6 +426,11 @@ async function applyArithmetic() {
         return;
     }
     
+    if (previewSessionId) {
+        await commitPreview('arithmetic');
+        return;
+    }
+    
     const operation = document.getElementById('operation').value;
     const value = parseFloat(document.getElementById('operationValue').value);
     
@@ -262,6 +459,59 @@ async function applyArithmetic() {
     }
 }
 
+// Операции над двумя изображениями (разность, смешивание и т.д.)
+async function applyCombine() {
+    const second = document.getElementById('secondImage').files[0];
+    if (!currentImage || !second) {
+        alert('Сначала загрузите оба изображения!');
+        return;
+    }
+    
+    const params = new URLSearchParams({
+        operation: document.getElementById('combineOperation').value,
+        alpha: document.getElementById('combineAlpha').value,
+        align: document.getElementById('combineAlign').value
+    });
+    
+    // При открытой сессии предпросмотра первое изображение уже на сервере
+    const send = (sessionId) => {
+        const formData = new FormData();
+        formData.append('second', second);
+        const query = new URLSearchParams(params);
+        if (sessionId) {
+            query.set('session_id', sessionId);
+        } else {
+            formData.append('file', currentImage);
+        }
+        return fetch(`/api/combine?${query}`, {
+            method: 'POST',
+            body: formData
+        });
+    };
+    
+    showLoader();
+    
+    try {
+        let response = await send(previewSessionId);
+        if (response.status === 404 && previewSessionId) {
+            // Сессия вытеснена из кэша сервера - загружаем файл
+            previewSessionId = null;
+            createPreviewSession(currentImage);
+            response = await send(null);
+        }
+        
+        if (!response.ok) throw new Error('Ошибка обработки');
+        
+        const data = await response.json();
+        displayResults(data, 'combine');
+    } catch (error) {
+        console.error('Error:', error);
+        alert('Ошибка при обработке изображения: ' + error.message);
+    } finally {
+        hideLoader();
+    }
+}
+
 // Применение эквализации гистограммы
 async function applyHistogramEqualization() {
     if (!currentImage) {
@@ -269,6 +519,11 @@ async function applyHistogramEqualization() {
         return;
     }
     
+    if (previewSessionId) {
+        await commitPreview('histogram');
+        return;
+    }
+    
     const method = document.getElementById('histMethod').value;
     
     const formData = new FormData();
@@ -295,8 +550,198 @@ async function applyHistogramEqualization() {
     }
 }
 
+// Идентификатор загруженного эталона (CDF эталона кэшируются на сервере)
+let referenceId = null;
+
+// Приведение гистограммы к эталону
+async function applyHistogramMatching() {
+    const reference = document.getElementById('referenceImage').files[0];
+    if (!currentImage || !reference) {
+        alert('Сначала загрузите изображение и эталон!');
+        return;
+    }
+    
+    showLoader();
+    
+    try {
+        // Эталон загружается один раз, дальше используется его идентификатор
+        if (!referenceId) {
+            const refData = new FormData();
+            refData.append('file', reference);
+            const refResponse = await fetch('/api/histogram-matching/reference', {
+                method: 'POST',
+                body: refData
+            });
+            if (!refResponse.ok) throw new Error('Ошибка загрузки эталона');
+            referenceId = (await refResponse.json()).reference_id;
+        }
+        
+        const params = new URLSearchParams({
+            reference_id: referenceId,
+            method: document.getElementById('histMethod').value
+        });
+        const formData = new FormData();
+        formData.append('file', currentImage);
+        
+        const response = await fetch(`/api/histogram-matching?${params}`, {
+            method: 'POST',
+            body: formData
+        });
+        
+        if (response.status === 404) {
+            // Эталон вытеснен из кэша сервера - загрузим заново при следующем запросе
+            referenceId = null;
+        }
+        if (!response.ok) throw new Error('Ошибка обработки');
+        
+        const data = await response.json();
+        displayResults(data, 'matching');
+    } catch (error) {
+        console.error('Error:', error);
+        alert('Ошибка при обработке изображения: ' + error.message);
+    } finally {
+        hideLoader();
+    }
+}
+
+// ============= ПРЕДПРОСМОТР =============
+
+// Имена операций на сервере для каждой вкладки
+const OPERATION_NAMES = {
+    'threshold': 'threshold',
+    'contrast': 'contrast',
+    'arithmetic': 'arithmetic',
+    'histogram': 'histogram-equalization'
+};
+
+// Сбор параметров операции с контролов вкладки
+function getOperationParams(type) {
+    if (type === 'threshold') {
+        return {
+            method: document.getElementById('thresholdMethod').value,
+            block_size: parseInt(document.getElementById('blockSize').value),
+            c_constant: parseFloat(document.getElementById('cConstant').value),
+            k_niblack: parseFloat(document.getElementById('kNiblack').value),
+            n_thresholds: parseInt(document.getElementById('nThresholds').value)
+        };
+    } else if (type === 'contrast') {
+        return {
+            alpha: parseFloat(document.getElementById('alpha').value),
+            beta: parseFloat(document.getElementById('beta').value)
+        };
+    } else if (type === 'arithmetic') {
+        return {
+            operation: document.getElementById('operation').value,
+            value: parseFloat(document.getElementById('operationValue').value)
+        };
+    }
+    return { method: document.getElementById('histMethod').value };
+}
+
+// Создание сессии предпросмотра: сервер кэширует уменьшенную копию
+async function createPreviewSession(file) {
+    const formData = new FormData();
+    formData.append('file', file);
+    
+    try {
+        const response = await fetch(`/api/preview?max_dim=${PREVIEW_MAX_DIM}`, {
+            method: 'POST',
+            body: formData
+        });
+        
+        if (!response.ok) throw new Error('Ошибка создания предпросмотра');
+        
+        const data = await response.json();
+        // Пользователь мог успеть выбрать другой файл
+        if (currentImage === file) {
+            previewSessionId = data.session_id;
+        }
+    } catch (error) {
+        console.error('Error:', error);
+        previewSessionId = null;
+    }
+}
+
+// Отложенный запрос предпросмотра (только последнее значение слайдера)
+function schedulePreview(type) {
+    if (!previewSessionId) return;
+    
+    clearTimeout(previewTimer);
+    previewTimer = setTimeout(() => renderPreview(type), PREVIEW_DEBOUNCE_MS);
+}
+
+// Обработка уменьшенной копии
+async function renderPreview(type) {
+    if (!previewSessionId) return;
+    
+    const requestId = ++previewRequestId;
+    
+    try {
+        const response = await fetch(`/api/preview/${previewSessionId}/render`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                operation: OPERATION_NAMES[type],
+                params: getOperationParams(type)
+            })
+        });
+        
+        if (response.status === 404) {
+            // Сессия вытеснена из кэша сервера - создаем заново
+            previewSessionId = null;
+            await createPreviewSession(currentImage);
+            return;
+        }
+        if (!response.ok) throw new Error('Ошибка обработки');
+        
+        const data = await response.json();
+        // Игнорируем устаревшие ответы
+        if (requestId === previewRequestId) {
+            displayResults(data, type, false);
+        }
+    } catch (error) {
+        console.error('Error:', error);
+    }
+}
+
+// Финальная обработка в полном разрешении (без повторной загрузки файла)
+async function commitPreview(type) {
+    clearTimeout(previewTimer);
+    previewRequestId++;
+    
+    showLoader();
+    
+    try {
+        const response = await fetch(`/api/preview/${previewSessionId}/commit`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                operation: OPERATION_NAMES[type],
+                params: getOperationParams(type)
+            })
+        });
+        
+        if (response.status === 404) {
+            previewSessionId = null;
+            throw new Error('Сессия предпросмотра устарела, повторите');
+        }
+        if (!response.ok) throw new Error('Ошибка обработки');
+        
+        const data = await response.json();
+        displayResults(data, type);
+    } catch (error) {
+        console.error('Error:', error);
+        alert('Ошибка при обработке изображения: ' + error.message);
+        if (!previewSessionId && currentImage) {
+            createPreviewSession(currentImage);
+        }
+    } finally {
+        hideLoader();
+    }
+}
+
 // Отображение результатов
-function displayResults(data, type) {
+function displayResults(data, type, scroll = true) {
     // Показываем секцию результатов
     document.getElementById('resultsSection').style.display = 'block';
     
@@ -311,7 +756,9 @@ function displayResults(data, type) {
     updateInfoPanel(data, type);
     
     // Прокручиваем к результатам
-    document.getElementById('resultsSection').scrollIntoView({ behavior: 'smooth' });
+    if (scroll) {
+        document.getElementById('resultsSection').scrollIntoView({ behavior: 'smooth' });
+    }
 }
 
 // Обновление гистограмм
@@ -412,11 +859,15 @@ function updateInfoPanel(data, type) {
     if (type === 'threshold') {
         const methodNames = {
             'otsu': 'Метод Оцу (Otsu)',
+            'otsu_multilevel': 'Многоуровневый Оцу',
             'adaptive_mean': 'Адаптивный порог (среднее)',
             'adaptive_gaussian': 'Адаптивный порог (Гаусс)',
             'niblack': 'Метод Niblack'
         };
         html += `<p><strong>Метод:</strong> ${methodNames[data.method]}</p>`;
+        if (data.thresholds) {
+            html += `<p><strong>Пороги:</strong> ${data.thresholds.join(', ')}</p>`;
+        }
     } else if (type === 'contrast') {
         html += `<p><strong>Коэффициент контраста (α):</strong> ${data.alpha}</p>`;
         html += `<p><strong>Смещение яркости (β):</strong> ${data.beta}</p>`;
@@ -430,7 +881,25 @@ function updateInfoPanel(data, type) {
         };
         html += `<p><strong>Операция:</strong> ${operationNames[data.operation]}</p>`;
         html += `<p><strong>Значение:</strong> ${data.value}</p>`;
-    } else if (type === 'histogram') {
+    } else if (type === 'combine') {
+        const operationNames = {
+            'absdiff': 'Модуль разности',
+            'add': 'Сложение',
+            'subtract': 'Вычитание',
+            'multiply': 'Умножение',
+            'blend': 'Смешивание',
+            'min': 'Минимум',
+            'max': 'Максимум'
+        };
+        html += `<p><strong>Операция:</strong> ${operationNames[data.operation]}</p>`;
+        if (data.operation === 'blend') {
+            html += `<p><strong>Вес второго изображения:</strong> ${data.alpha}</p>`;
+        }
+        html += `<p><strong>Размер:</strong> ${data.width} × ${data.height}</p>`;
+    } else if (type === 'histogram' || type === 'matching') {
+        if (type === 'matching') {
+            html += '<p><strong>Операция:</strong> Приведение гистограммы к эталону</p>';
+        }
         const methodNames = {
             'rgb': 'RGB (все каналы)',
             'hsv_v': 'HSV (яркость V)',
@@ -454,9 +923,11 @@ function downloadResult() {
 // Сброс и загрузка нового изображения
 function resetImage() {
     currentImage = null;
+    previewSessionId = null;
     document.getElementById('imageInput').value = '';
     document.getElementById('fileName').textContent = '';
     document.getElementById('resultsSection').style.display = 'none';
+    document.getElementById('compareSection').style.display = 'none';
     disableApplyButtons();
     
     // Прокручиваем наверх
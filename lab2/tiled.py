@@ -0,0 +1,395 @@
+"""
+Обработка изображений больше оперативной памяти (out-of-core)
+
+Изображение хранится на диске в несжатом виде (.npy) и обрабатывается
+полосами строк: каждая полоса отображается в память (mmap), обрабатывается
+и записывается в выходной .npy, тоже через mmap. Высота полосы подбирается
+под бюджет памяти, поэтому пиковое потребление не зависит от размера
+изображения.
+
+- поэлементные операции (contrast, arithmetic) - одна LUT на полосу;
+- операции по гистограмме (otsu, otsu_multilevel, histogram-equalization,
+  histogram-matching) - два прохода: накопление гистограммы по полосам,
+  затем LUT;
+- локальные операции (adaptive_mean, adaptive_gaussian, niblack) - полосы
+  с перекрытием block_size // 2 строк, результат совпадает с обработкой
+  целого изображения.
+
+Примеры:
+    python tiled.py scan.tif scan_bin.npy --op threshold:method=niblack,block_size=51
+    python tiled.py scan.npy out.npy --op histogram-equalization:method=hsv_v --memory-mb 128
+
+Вход в формате .npy используется напрямую. Остальные форматы один раз
+декодируются целиком и сохраняются в .npy рядом с результатом - для
+действительно больших сканов лучше подготовить .npy заранее.
+Результат читается без загрузки в память: np.load(path, mmap_mode="r").
+"""
+import argparse
+import os
+import resource
+import sys
+import time
+
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+
+from app import (OPERATION_PARAMS, apply_operation, histogram_cdf, matching_lut, multi_otsu_thresholds, multilevel_lut, point_operation_lut,
+                 reference_cdfs)
+from batch import parse_operation
+
+# Оценка временных буферов операций на пиксель полосы (с запасом:
+# niblack держит несколько float64-карт, цветовые преобразования - копии каналов)
+WORK_BYTES_PER_PIXEL = 48
+DEFAULT_MEMORY_MB = 256
+
+
+class ImageStore:
+    """
+    Изображение в файле .npy, доступное полосами строк через mmap
+
+    Полоса отображается только на время обработки и сразу освобождается,
+    поэтому в памяти процесса находится не больше одной полосы.
+    """
+
+    def __init__(self, path: str):
+        array = np.load(path, mmap_mode="r")
+        if array.dtype != np.uint8 or array.ndim not in (2, 3) or not array.flags.c_contiguous:
+            raise ValueError(f"{path}: expected C-ordered uint8 array of shape (H, W) or (H, W, 3)")
+        self.path = path
+        self.shape = array.shape
+        self.offset = array.offset
+        del array
+
+    @classmethod
+    def create(cls, path: str, shape: tuple) -> "ImageStore":
+        """Создание пустого хранилища (файл выделяется без заполнения)"""
+        array = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=shape)
+        del array
+        return cls(path)
+
+    @property
+    def height(self) -> int:
+        return self.shape[0]
+
+    @property
+    def width(self) -> int:
+        return self.shape[1]
+
+    @property
+    def channels(self) -> int:
+        return 1 if len(self.shape) == 2 else self.shape[2]
+
+    @property
+    def row_bytes(self) -> int:
+        return self.width * self.channels
+
+    def rows(self, y0: int, y1: int, writable: bool = False) -> np.memmap:
+        """Отображение строк [y0, y1) в память"""
+        return np.memmap(self.path, dtype=np.uint8, mode="r+" if writable else "r",
+                         offset=self.offset + y0 * self.row_bytes,
+                         shape=(y1 - y0, *self.shape[1:]))
+
+
+def decode_image(path: str, gray: bool = False) -> np.ndarray:
+    """
+    Декодирование файла без ограничений веб-загрузки
+
+    load_image_from_upload отклоняет изображения больше LAB2_MAX_MEGAPIXELS,
+    а здесь большие сканы - основной случай. OpenCV учитывает
+    EXIF-ориентацию; то, что он не читает (или что больше его
+    собственного предела), декодируется через PIL без проверки
+    на "decompression bomb". Ошибки - OSError/ValueError.
+    """
+    if os.path.getsize(path) == 0:
+        raise ValueError(f"{path}: empty file")
+
+    image = cv2.imread(path, cv2.IMREAD_GRAYSCALE if gray else cv2.IMREAD_COLOR)
+    if image is not None:
+        return image
+
+    Image.MAX_IMAGE_PIXELS = None
+    with Image.open(path) as pil_image:
+        pil_image = ImageOps.exif_transpose(pil_image)
+        mode = 'L' if gray else 'RGB'
+        if pil_image.mode != mode:
+            pil_image = pil_image.convert(mode)
+        array = np.asarray(pil_image)
+    return array if gray else cv2.cvtColor(array, cv2.COLOR_RGB2BGR)
+
+
+def convert_to_store(src: str, dst: str, gray: bool = False) -> ImageStore:
+    """
+    Подготовка входа: .npy используется как есть, остальные форматы
+    декодируются один раз и записываются в .npy по полосам
+    """
+    if src.lower().endswith(".npy"):
+        return ImageStore(src)
+
+    image = decode_image(src, gray=gray)
+    store = ImageStore.create(dst, image.shape)
+    step = max(1, (64 << 20) // store.row_bytes)
+    for y0 in range(0, store.height, step):
+        band = store.rows(y0, min(y0 + step, store.height), writable=True)
+        band[:] = image[y0:y0 + len(band)]
+        band.flush()
+        del band
+    del image
+    return store
+
+
+def band_height(store: ImageStore, out_channels: int, halo: int, memory_budget: int) -> int:
+    """Высота полосы (без перекрытия), при которой полоса укладывается в бюджет"""
+    per_row = store.width * (store.channels + out_channels + WORK_BYTES_PER_PIXEL)
+    rows = memory_budget // per_row - 2 * halo
+    if rows < 1:
+        raise ValueError(
+            f"memory budget {memory_budget / 2**20:.1f} MB is too small for width {store.width} "
+            f"(need at least {(2 * halo + 1) * per_row / 2**20:.1f} MB)"
+        )
+    return min(rows, store.height)
+
+
+def iter_bands(height: int, rows: int, halo: int = 0):
+    """Полосы: (начало, конец) результата и (начало, конец) чтения с перекрытием"""
+    for y0 in range(0, height, rows):
+        y1 = min(y0 + rows, height)
+        yield y0, y1, max(0, y0 - halo), min(height, y1 + halo)
+
+
+def to_gray(band: np.ndarray) -> np.ndarray:
+    return band if band.ndim == 2 else cv2.cvtColor(band, cv2.COLOR_BGR2GRAY)
+
+
+def accumulate_histogram(store: ImageStore, rows: int, plane) -> np.ndarray:
+    """
+    Гистограмма по всему изображению, накопленная по полосам
+
+    plane(band) возвращает (изображение, канал), по которому считается
+    гистограмма; channel=None - по каждому каналу отдельно.
+    """
+    total = None
+    for y0, y1, _, _ in iter_bands(store.height, rows):
+        band = store.rows(y0, y1)
+        image, channel = plane(band)
+        channels = range(image.shape[2]) if channel is None else [channel]
+        hist = np.stack([cv2.calcHist([image], [c], None, [256], [0, 256]).ravel() for c in channels])
+        total = hist if total is None else total + hist
+        del band, image
+    return total
+
+
+def otsu_threshold(hist: np.ndarray) -> int:
+    """Порог Оцу по гистограмме (тот же расчет, что в cv2.THRESH_OTSU)"""
+    hist = np.ravel(hist).astype(np.float64)
+    scale = 1.0 / hist.sum()
+    mu = float(np.dot(np.arange(256), hist)) * scale
+    eps = float(np.finfo(np.float32).eps)
+    q1 = mu1 = max_sigma = 0.0
+    threshold = 0
+    for i in range(256):
+        p_i = hist[i] * scale
+        mu1 *= q1
+        q1 += p_i
+        q2 = 1.0 - q1
+        if min(q1, q2) < eps or max(q1, q2) > 1.0 - eps:
+            continue
+        mu1 = (mu1 + i * p_i) / q1
+        mu2 = (mu - q1 * mu1) / q2
+        sigma = q1 * q2 * (mu1 - mu2) ** 2
+        if sigma > max_sigma:
+            max_sigma = sigma
+            threshold = i
+    return threshold
+
+
+def equalize_lut(hist: np.ndarray) -> np.ndarray:
+    """Таблица эквализации по гистограмме (тот же расчет, что в cv2.equalizeHist)"""
+    hist = np.ravel(hist).astype(np.int64)
+    lut = np.zeros(256, dtype=np.uint8)
+    first = int(np.flatnonzero(hist)[0])
+    total = int(hist.sum())
+    if hist[first] == total:
+        lut[:] = first
+        return lut
+    scale = np.float32(255.0 / (total - hist[first]))
+    cumulative = np.cumsum(hist[first + 1:])
+    lut[first + 1:] = np.clip(np.rint(cumulative.astype(np.float32) * scale), 0, 255)
+    return lut
+
+
+def luminance_plane(method: str):
+    """Пространство и канал яркости для методов hsv_v / hls_l"""
+    if method == "hsv_v":
+        return cv2.COLOR_BGR2HSV, cv2.COLOR_HSV2BGR, 2
+    return cv2.COLOR_BGR2HLS, cv2.COLOR_HLS2BGR, 1
+
+
+def apply_luminance_lut(band: np.ndarray, method: str, lut: np.ndarray) -> np.ndarray:
+    to_space, from_space, channel = luminance_plane(method)
+    planes = list(cv2.split(cv2.cvtColor(band, to_space)))
+    planes[channel] = cv2.LUT(planes[channel], lut)
+    return cv2.cvtColor(cv2.merge(planes), from_space)
+
+
+def plan_operation(store: ImageStore, operation: str, params: dict, memory_budget: int,
+                   reference: dict = None) -> tuple:
+    """
+    Выбор способа обработки по полосам
+
+    Возвращает (функция полосы, перекрытие, число выходных каналов, высота полосы).
+    Для операций по гистограмме здесь же выполняется первый проход.
+    """
+    p = OPERATION_PARAMS[operation](**params)
+    color = store.channels == 3
+    out_channels = 1 if operation == "threshold" else store.channels
+
+    lut = point_operation_lut(operation, p)
+    if lut is not None:
+        rows = band_height(store, out_channels, 0, memory_budget)
+        return (lambda band: cv2.LUT(band, lut)), 0, out_channels, rows
+
+    if operation == "threshold" and p.method in ("adaptive_mean", "adaptive_gaussian", "niblack"):
+        halo = (p.block_size | 1) // 2
+        rows = band_height(store, out_channels, halo, memory_budget)
+        return (lambda band: apply_operation(band, operation, params)[0]), halo, out_channels, rows
+
+    rows = band_height(store, out_channels, 0, memory_budget)
+    gray_plane = lambda band: (to_gray(band), 0)
+
+    if operation == "threshold":
+        hist = accumulate_histogram(store, rows, gray_plane)
+        if p.method == "otsu":
+            threshold = otsu_threshold(hist)
+            lut = np.where(np.arange(256) > threshold, 255, 0).astype(np.uint8)
+        else:
+            lut = multilevel_lut(multi_otsu_thresholds(hist.ravel(), p.n_thresholds))
+        return (lambda band: cv2.LUT(to_gray(band), lut)), 0, out_channels, rows
+
+    if operation == "histogram-matching" and reference is None:
+        raise ValueError("histogram-matching requires a reference image")
+
+    if not color:
+        hist = accumulate_histogram(store, rows, gray_plane)
+        if operation == "histogram-equalization":
+            lut = equalize_lut(hist)
+        else:
+            lut = matching_lut(histogram_cdf(hist), reference["gray"])
+        return (lambda band: cv2.LUT(band, lut)), 0, out_channels, rows
+
+    if p.method == "rgb":
+        hist = accumulate_histogram(store, rows, lambda band: (band, None))
+        if operation == "histogram-equalization":
+            tables = [equalize_lut(h) for h in hist]
+        else:
+            tables = [matching_lut(histogram_cdf(h), reference["rgb"][c]) for c, h in enumerate(hist)]
+        lut = np.stack(tables, axis=1).reshape(1, 256, 3)
+        return (lambda band: cv2.LUT(band, lut)), 0, out_channels, rows
+
+    to_space, _, channel = luminance_plane(p.method)
+    hist = accumulate_histogram(store, rows, lambda band: (cv2.cvtColor(band, to_space), channel))
+    if operation == "histogram-equalization":
+        lut = equalize_lut(hist)
+    else:
+        lut = matching_lut(histogram_cdf(hist), reference[p.method])
+    return (lambda band: apply_luminance_lut(band, p.method, lut)), 0, out_channels, rows
+
+
+def current_rss() -> int:
+    """Текущий RSS процесса в байтах (Linux), 0 если недоступно"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def process_tiled(src: ImageStore, dst_path: str, operation: str, params: dict,
+                  memory_budget: int = DEFAULT_MEMORY_MB << 20, reference: dict = None) -> tuple:
+    """
+    Обработка хранилища src по полосам с записью результата в dst_path (.npy)
+
+    Возвращает выходное хранилище и статистику (число полос, пиковый RSS).
+    """
+    fn, halo, out_channels, rows = plan_operation(src, operation, params, memory_budget, reference)
+    shape = (src.height, src.width) if out_channels == 1 else (src.height, src.width, out_channels)
+    dst = ImageStore.create(dst_path, shape)
+
+    bands = 0
+    peak_rss = current_rss()
+    for y0, y1, r0, r1 in iter_bands(src.height, rows, halo):
+        band = src.rows(r0, r1)
+        result = fn(band)
+        out = dst.rows(y0, y1, writable=True)
+        out[:] = result[y0 - r0:y1 - r0]
+        out.flush()
+        peak_rss = max(peak_rss, current_rss())
+        del band, result, out
+        bands += 1
+
+    return dst, {"bands": bands, "band_rows": rows, "halo": halo, "peak_rss": peak_rss}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Обработка изображений больше оперативной памяти по полосам"
+    )
+    parser.add_argument("input", help="изображение или .npy (uint8, H x W или H x W x 3)")
+    parser.add_argument("output", help="результат в формате .npy")
+    parser.add_argument("--op", action="append", type=parse_operation, required=True,
+                        metavar="NAME[:key=value,...]",
+                        help="операция (как в batch.py); можно указать несколько раз для цепочки")
+    parser.add_argument("--memory-mb", type=int, default=DEFAULT_MEMORY_MB,
+                        help=f"бюджет памяти на полосу, МБ (по умолчанию {DEFAULT_MEMORY_MB})")
+    parser.add_argument("--reference", help="эталонное изображение для histogram-matching")
+    args = parser.parse_args(argv)
+
+    if not args.output.lower().endswith(".npy"):
+        parser.error("output must be a .npy file")
+    if any(op == "histogram-matching" for op, _ in args.op) and not args.reference:
+        parser.error("histogram-matching requires --reference")
+
+    start = time.perf_counter()
+    temporary = []
+    try:
+        reference = reference_cdfs(decode_image(args.reference)) if args.reference else None
+
+        gray = args.op[0][0] == "threshold"
+        source_path = f"{args.output}.source.npy"
+        store = convert_to_store(args.input, source_path, gray=gray)
+        if store.path == source_path:
+            temporary.append(source_path)
+        print(f"input: {store.width}x{store.height}x{store.channels} "
+              f"({time.perf_counter() - start:.1f}s)", file=sys.stderr)
+
+        for i, (operation, params) in enumerate(args.op):
+            last = i == len(args.op) - 1
+            path = args.output if last else f"{args.output}.step{i}.npy"
+            step_start = time.perf_counter()
+            result, stats = process_tiled(store, path, operation, params,
+                                          args.memory_mb << 20, reference)
+            print(f"{operation}: {stats['bands']} bands x {stats['band_rows']} rows, "
+                  f"halo={stats['halo']}, {time.perf_counter() - step_start:.1f}s, "
+                  f"peak RSS {stats['peak_rss'] >> 20} MB", file=sys.stderr)
+            if store.path in temporary:
+                os.remove(store.path)
+                temporary.remove(store.path)
+            if not last:
+                temporary.append(path)
+            store = result
+    except (OSError, ValueError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        for path in temporary:
+            if os.path.exists(path):
+                os.remove(path)
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss >> 10
+    print(f"done: {args.output} in {time.perf_counter() - start:.1f}s, "
+          f"process max RSS {max_rss} MB", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
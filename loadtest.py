@@ -0,0 +1,610 @@
+"""
+Нагрузочное тестирование лабораторных №1-3
+
+Скрипт сам запускает приложения (как `python app.py` в каталоге лабораторной),
+дожидается готовности и нагружает их смешанным потоком запросов
+с заданным числом одновременных клиентов:
+
+- lab1: конвертации цветов из всех моделей через WebSocket-канал /ws/convert
+  (основной путь выбора цвета) и через HTTP, изредка извлечение палитры
+- lab2: загрузка изображений из lab2/test_images со случайной операцией
+- lab3: растеризация отрезков и окружностей разной длины и радиуса
+
+Для каждого уровня параллельности выводятся пропускная способность,
+перцентили задержки, доля ошибок и память сервера (RSS всего дерева
+процессов, включая перезапускающий процесс Flask в режиме debug).
+
+lab2 по умолчанию запускается без кэша результатов, чтобы замер отражал
+обработку, а не поиск в кэше, и был сравним между запусками. С --cache
+кэш включается в новом временном каталоге (он прогревается от уровня
+к уровню, это стоит учитывать при сравнении).
+
+Примеры:
+    python loadtest.py
+    python loadtest.py --apps lab2 --concurrency 1,4,16 --duration 30
+    python loadtest.py --apps lab1 --url lab1=http://10.0.0.5:8000 --json out.json
+
+Клиенты - потоки с постоянными HTTP- и WebSocket-соединениями.
+Для WebSocket нужен пакет websockets (есть в lab1/requirements.txt);
+без него lab1 нагружается только через HTTP. Клиент работает на той же машине и делит с сервером
+процессор, поэтому на малом числе ядер результаты стоит сравнивать
+только между собой.
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import urlencode, urlsplit
+
+try:
+    from websockets.sync.client import connect as ws_connect
+except ImportError:
+    ws_connect = None
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+TEST_IMAGES = os.path.join(ROOT, "lab2", "test_images")
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+
+# Адреса по умолчанию совпадают с app.run/uvicorn.run в самих лабораторных
+DEFAULT_URLS = {
+    "lab1": "http://127.0.0.1:8000",
+    "lab2": "http://127.0.0.1:8001",
+    "lab3": "http://127.0.0.1:5000",
+}
+
+STARTUP_TIMEOUT = 60
+RSS_SAMPLE_INTERVAL = 0.2
+REQUEST_TIMEOUT = 120
+
+# Доля конвертаций lab1, идущих через WebSocket (как у страницы выбора цвета)
+WS_SHARE = 0.6
+
+
+# ==================== Генерация запросов ====================
+
+class Request:
+    """Готовый к отправке запрос"""
+    __slots__ = ("label", "method", "path", "body", "headers")
+
+    def __init__(self, label, method, path, body=None, headers=None):
+        self.label = label
+        self.method = method
+        self.path = path
+        self.body = body
+        self.headers = headers or {}
+
+
+def ws_request(label: str, path: str, message: list) -> Request:
+    """Сообщение WebSocket-канала: ответ ждется до следующего сообщения"""
+    return Request(label, "WS", path, json.dumps(message))
+
+
+def json_request(label: str, path: str, payload: dict) -> Request:
+    return Request(label, "POST", path, json.dumps(payload).encode(),
+                   {"Content-Type": "application/json"})
+
+
+def multipart_request(label: str, path: str, params: dict,
+                      filename: str, content: bytes) -> Request:
+    """Запрос с файлом в поле file (multipart/form-data)"""
+    boundary = uuid.uuid4().hex
+    head = (f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n").encode()
+    body = head + content + f"\r\n--{boundary}--\r\n".encode()
+    query = "?" + urlencode(params) if params else ""
+    return Request(label, "POST", path + query, body,
+                   {"Content-Type": f"multipart/form-data; boundary={boundary}"})
+
+
+def load_test_images(limit_mb: float) -> list:
+    """Изображения из lab2/test_images не больше limit_mb мегабайт"""
+    images = []
+    for name in sorted(os.listdir(TEST_IMAGES)):
+        if os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS:
+            continue
+        path = os.path.join(TEST_IMAGES, name)
+        if os.path.getsize(path) > limit_mb * 1024 * 1024:
+            continue
+        with open(path, "rb") as f:
+            images.append((name, f.read()))
+    if not images:
+        raise SystemExit(f"В {TEST_IMAGES} нет подходящих изображений")
+    return images
+
+
+def lab1_random_color(rng: random.Random) -> tuple[str, list]:
+    """Случайная модель и значения в ее допустимом диапазоне"""
+    model = rng.choice(["rgb", "hls", "cmyk", "xyz", "lab"])
+    if model == "rgb":
+        return model, [rng.randint(0, 255) for _ in range(3)]
+    if model == "hls":
+        return model, [rng.uniform(0, 360), rng.uniform(0, 100), rng.uniform(0, 100)]
+    if model == "cmyk":
+        return model, [rng.uniform(0, 100) for _ in range(4)]
+    if model == "xyz":
+        return model, [rng.uniform(0, 95.047), rng.uniform(0, 100), rng.uniform(0, 108.883)]
+    return model, [rng.uniform(0, 100), rng.uniform(-100, 100), rng.uniform(-100, 100)]
+
+
+def lab1_mix(rng: random.Random, images: list) -> Request:
+    """Цветовой круг: в основном конвертации, изредка извлечение палитры"""
+    if ws_connect is not None and rng.random() < WS_SHARE:
+        model, values = lab1_random_color(rng)
+        return ws_request(f"ws:{model}", "/ws/convert", [rng.randrange(1 << 30), model, *values])
+
+    roll = rng.random()
+    if roll < 0.35:
+        return json_request("rgb_to_all", "/convert/rgb_to_all",
+                            {"r": rng.randint(0, 255), "g": rng.randint(0, 255), "b": rng.randint(0, 255)})
+    if roll < 0.55:
+        return json_request("hls_to_all", "/convert/hls_to_all",
+                            {"h": rng.uniform(0, 360), "l": rng.uniform(0, 100), "s": rng.uniform(0, 100)})
+    if roll < 0.75:
+        return json_request("cmyk_to_all", "/convert/cmyk_to_all",
+                            {"c": rng.uniform(0, 100), "m": rng.uniform(0, 100),
+                             "y": rng.uniform(0, 100), "k": rng.uniform(0, 100)})
+    if roll < 0.85:
+        return json_request("xyz_to_all", "/convert/xyz_to_all",
+                            {"x": rng.uniform(0, 95.047), "y": rng.uniform(0, 100), "z": rng.uniform(0, 108.883)})
+    if roll < 0.98:
+        return json_request("lab_to_all", "/convert/lab_to_all",
+                            {"l": rng.uniform(0, 100), "a": rng.uniform(-100, 100), "b": rng.uniform(-100, 100)})
+    name, content = rng.choice(images)
+    return multipart_request("palette_extract", "/palette/extract",
+                             {"n_colors": rng.choice([4, 8, 16]),
+                              "method": rng.choice(["kmeans", "median_cut"])},
+                             name, content)
+
+
+def lab2_mix(rng: random.Random, images: list) -> Request:
+    """Обработка изображений: случайная операция со случайными параметрами"""
+    name, content = rng.choice(images)
+    roll = rng.random()
+    if roll < 0.35:
+        method = rng.choice(["otsu", "otsu_multilevel", "adaptive_mean", "adaptive_gaussian", "niblack"])
+        params = {"method": method, "block_size": rng.choice([11, 15, 25])}
+        return multipart_request(f"threshold:{method}", "/api/threshold", params, name, content)
+    if roll < 0.60:
+        params = {"alpha": round(rng.uniform(0.5, 2.0), 1), "beta": rng.randint(-50, 50)}
+        return multipart_request("contrast", "/api/contrast", params, name, content)
+    if roll < 0.80:
+        method = rng.choice(["rgb", "hsv_v", "hls_l"])
+        return multipart_request(f"equalization:{method}", "/api/histogram-equalization",
+                                 {"method": method}, name, content)
+    operation = rng.choice(["add", "subtract", "multiply", "divide"])
+    value = rng.choice([1.5, 2, 30, 50]) if operation in ("multiply", "divide") else rng.randint(10, 80)
+    return multipart_request(f"arithmetic:{operation}", "/api/arithmetic",
+                             {"operation": operation, "value": value}, name, content)
+
+
+def lab3_mix(rng: random.Random, images: list) -> Request:
+    """Растеризация: длины отрезков и радиусы распределены логарифмически"""
+    if rng.random() < 0.8:
+        algorithm = rng.choice(["step_by_step", "dda", "bresenham", "wu", "castle_pitway"])
+        length = math.exp(rng.uniform(math.log(5), math.log(2000)))
+        angle = rng.uniform(0, 2 * math.pi)
+        x1, y1 = rng.randint(-500, 500), rng.randint(-500, 500)
+        return json_request(f"line:{algorithm}", "/draw", {
+            "algorithm": algorithm, "x1": x1, "y1": y1,
+            "x2": x1 + round(length * math.cos(angle)),
+            "y2": y1 + round(length * math.sin(angle)),
+        })
+    r = round(math.exp(rng.uniform(math.log(2), math.log(1000))))
+    return json_request("circle", "/draw_circle",
+                        {"xc": rng.randint(-500, 500), "yc": rng.randint(-500, 500), "r": r})
+
+
+MIXES = {"lab1": lab1_mix, "lab2": lab2_mix, "lab3": lab3_mix}
+
+
+# ==================== Сервер ====================
+
+def process_tree_rss(root_pid: int) -> int:
+    """Суммарный RSS процесса и всех его потомков в байтах (Linux /proc)"""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # Имя процесса в скобках может содержать пробелы
+        ppid = int(stat[stat.rindex(")") + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+
+    total, stack = 0, [root_pid]
+    while stack:
+        pid = stack.pop()
+        stack.extend(children.get(pid, ()))
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total
+
+
+class Server:
+    """Запущенное приложение лабораторной (или внешний адрес без запуска)"""
+
+    def __init__(self, app: str, url: str, launch: bool, log_path: str = None,
+                 env: dict = None, cleanup: list = ()):
+        self.app = app
+        self.url = url
+        self.launch = launch
+        self.log_path = log_path
+        self.env = env or {}
+        self.cleanup = list(cleanup)
+        self.process = None
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+
+    def start(self):
+        if self.launch:
+            log = open(self.log_path, "wb") if self.log_path else subprocess.DEVNULL
+            # Отдельная группа процессов, чтобы остановить и перезапускающий процесс Flask
+            self.process = subprocess.Popen(
+                [sys.executable, "app.py"], cwd=os.path.join(ROOT, self.app),
+                env={**os.environ, **self.env},
+                stdout=log, stderr=subprocess.STDOUT, start_new_session=True,
+            )
+        self.wait_ready()
+
+    def wait_ready(self):
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process is not None and self.process.poll() is not None:
+                raise SystemExit(f"{self.app}: процесс завершился с кодом {self.process.returncode}")
+            try:
+                conn = http.client.HTTPConnection(self.host, self.port, timeout=2)
+                conn.request("GET", "/")
+                status = conn.getresponse().status
+                conn.close()
+                if status == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.25)
+        raise SystemExit(f"{self.app}: сервер {self.url} не ответил за {STARTUP_TIMEOUT} с")
+
+    def rss(self):
+        if self.process is None:
+            return None
+        return process_tree_rss(self.process.pid)
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            os.killpg(self.process.pid, signal.SIGTERM)
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                os.killpg(self.process.pid, signal.SIGKILL)
+                self.process.wait()
+        for path in self.cleanup:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class RssSampler(threading.Thread):
+    """Периодический замер памяти сервера во время нагрузки"""
+
+    def __init__(self, server: Server):
+        super().__init__(daemon=True)
+        self.server = server
+        self.samples = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            value = self.server.rss()
+            if value is not None:
+                self.samples.append(value)
+            self.stopped.wait(RSS_SAMPLE_INTERVAL)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+# ==================== Нагрузка ====================
+
+def is_error(status) -> bool:
+    """Статус - код HTTP, либо имя исключения / "ws-error" при ошибке"""
+    return not (isinstance(status, int) and status < 400)
+
+
+class Client:
+    """Соединения одного клиента: HTTP и (по первому запросу) WebSocket"""
+
+    def __init__(self, server: "Server"):
+        self.server = server
+        self.http = None
+        self.ws = None
+
+    def send(self, request: Request) -> tuple:
+        """Выполнение запроса: (статус, заголовок X-Cache)"""
+        if request.method == "WS":
+            return self._send_ws(request)
+        try:
+            if self.http is None:
+                self.http = http.client.HTTPConnection(self.server.host, self.server.port,
+                                                       timeout=REQUEST_TIMEOUT)
+            self.http.request(request.method, request.path, request.body, request.headers)
+            response = self.http.getresponse()
+            response.read()
+            if response.will_close:
+                self.http.close()
+                self.http = None
+            return response.status, response.getheader("X-Cache")
+        except (OSError, http.client.HTTPException) as e:
+            if self.http is not None:
+                self.http.close()
+            self.http = None
+            return type(e).__name__, None
+
+    def _send_ws(self, request: Request) -> tuple:
+        """Одно сообщение в полете, как у страницы: ждем ответ с тем же seq"""
+        try:
+            if self.ws is None:
+                url = f"ws://{self.server.host}:{self.server.port}{request.path}"
+                self.ws = ws_connect(url, open_timeout=REQUEST_TIMEOUT)
+            self.ws.send(request.body)
+            seq = json.loads(request.body)[0]
+            while True:
+                reply = json.loads(self.ws.recv(timeout=REQUEST_TIMEOUT))
+                if reply[0] == seq:
+                    break
+            # Успешный ответ учитывается как HTTP 200
+            return ("ws-error" if reply[1] == "error" else 200), None
+        except Exception as e:
+            if self.ws is not None:
+                self.ws.close()
+            self.ws = None
+            return type(e).__name__, None
+
+    def close(self):
+        if self.http is not None:
+            self.http.close()
+        if self.ws is not None:
+            self.ws.close()
+
+
+def client_loop(server: Server, mix, images: list, seed: int,
+                measure_from: float, stop_at: float, results: list):
+    """
+    Один клиент: запросы подряд по постоянным соединениям
+
+    Запросы, начатые до measure_from (прогрев), не учитываются.
+    В results добавляются кортежи (метка, задержка в секундах, статус, попадание в кэш).
+    """
+    rng = random.Random(seed)
+    client = Client(server)
+    try:
+        while time.monotonic() < stop_at:
+            request = mix(rng, images)
+            began = time.monotonic()
+            status, cache = client.send(request)
+            elapsed = time.monotonic() - began
+            if began >= measure_from:
+                results.append((request.label, elapsed, status, cache))
+    finally:
+        client.close()
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    """Перцентиль по ближайшему рангу"""
+    if not sorted_values:
+        return float("nan")
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(records: list, duration: float) -> dict:
+    latencies = sorted(r[1] for r in records)
+    errors = sum(1 for r in records if is_error(r[2]))
+    cached = [r[3] for r in records if r[3] is not None]
+    summary = {
+        "requests": len(records),
+        "errors": errors,
+        "error_rate": errors / len(records) if records else 0.0,
+        "throughput_rps": len(records) / duration if duration > 0 else 0.0,
+        "latency_ms": {
+            f"p{q}": percentile(latencies, q) * 1000 for q in (50, 90, 95, 99)
+        },
+    }
+    summary["latency_ms"]["max"] = latencies[-1] * 1000 if latencies else float("nan")
+    if cached:
+        summary["cache_hit_rate"] = cached.count("HIT") / len(cached)
+    return summary
+
+
+def run_level(server: Server, mix, images: list, concurrency: int,
+              duration: float, warmup: float, seed: int) -> dict:
+    """Нагрузка с заданным числом клиентов в течение warmup + duration секунд"""
+    per_client = [[] for _ in range(concurrency)]
+    start = time.monotonic()
+    measure_from = start + warmup
+    stop_at = measure_from + duration
+
+    sampler = RssSampler(server)
+    rss_before = server.rss()
+    sampler.start()
+    threads = [
+        threading.Thread(target=client_loop, daemon=True,
+                         args=(server, mix, images, seed * 1000 + i,
+                               measure_from, stop_at, per_client[i]))
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    sampler.stop()
+    # Медленные запросы могут завершиться после stop_at, поэтому
+    # пропускная способность считается по фактическому времени
+    measured = max(time.monotonic() - measure_from, 1e-9)
+
+    records = [r for client in per_client for r in client]
+    result = {"concurrency": concurrency, "duration_s": measured, **summarize(records, measured)}
+
+    by_label = {}
+    for record in records:
+        by_label.setdefault(record[0], []).append(record)
+    result["endpoints"] = {label: summarize(rs, measured) for label, rs in sorted(by_label.items())}
+
+    error_kinds = {}
+    for record in records:
+        if is_error(record[2]):
+            error_kinds[str(record[2])] = error_kinds.get(str(record[2]), 0) + 1
+    result["error_kinds"] = error_kinds
+
+    if sampler.samples:
+        result["rss_mb"] = {
+            "before": rss_before / 2**20,
+            "peak": max(sampler.samples) / 2**20,
+            "after": sampler.samples[-1] / 2**20,
+        }
+    return result
+
+
+# ==================== Отчет ====================
+
+def print_level(app: str, result: dict, verbose: bool):
+    lat = result["latency_ms"]
+    line = (f"{app}  c={result['concurrency']:<4} "
+            f"{result['throughput_rps']:8.1f} req/s  "
+            f"p50 {lat['p50']:8.2f}  p90 {lat['p90']:8.2f}  p99 {lat['p99']:8.2f}  max {lat['max']:8.2f} ms  "
+            f"err {result['error_rate'] * 100:5.2f}%")
+    if "rss_mb" in result:
+        rss = result["rss_mb"]
+        line += f"  RSS {rss['before']:.0f}->{rss['peak']:.0f} MB"
+    if "cache_hit_rate" in result:
+        line += f"  cache hit {result['cache_hit_rate'] * 100:.0f}%"
+    print(line, flush=True)
+
+    if result["error_kinds"]:
+        kinds = ", ".join(f"{k}: {v}" for k, v in sorted(result["error_kinds"].items()))
+        print(f"      ошибки: {kinds}")
+    if verbose:
+        for label, s in result["endpoints"].items():
+            lat = s["latency_ms"]
+            print(f"      {label:<28} n={s['requests']:<6} "
+                  f"p50 {lat['p50']:8.2f}  p99 {lat['p99']:8.2f} ms  err {s['errors']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочное тестирование лабораторных №1-3")
+    parser.add_argument("--apps", default="lab1,lab2,lab3",
+                        help="Приложения через запятую (по умолчанию все)")
+    parser.add_argument("--concurrency", default="1,4,16",
+                        help="Уровни числа одновременных клиентов через запятую")
+    parser.add_argument("--duration", type=float, default=10.0,
+                        help="Длительность замера на каждом уровне, секунд")
+    parser.add_argument("--warmup", type=float, default=2.0,
+                        help="Прогрев перед замером (не учитывается), секунд")
+    parser.add_argument("--max-image-mb", type=float, default=1.0,
+                        help="Не загружать изображения из test_images больше этого размера")
+    parser.add_argument("--seed", type=int, default=0, help="Зерно генератора запросов")
+    parser.add_argument("--cache", action="store_true",
+                        help="Включить кэш результатов lab2 (в новом временном каталоге)")
+    parser.add_argument("--url", action="append", default=[], metavar="APP=URL",
+                        help="Нагружать уже запущенный сервер вместо запуска (RSS не измеряется)")
+    parser.add_argument("--logs", metavar="DIR", help="Сохранять вывод серверов в каталог")
+    parser.add_argument("--json", metavar="FILE", help="Сохранить результаты в JSON")
+    parser.add_argument("--verbose", "-v", action="store_true",
+                        help="Показывать статистику по каждому типу запроса")
+    args = parser.parse_args(argv)
+
+    args.apps = [a.strip() for a in args.apps.split(",") if a.strip()]
+    unknown = [a for a in args.apps if a not in MIXES]
+    if unknown:
+        parser.error(f"Неизвестные приложения: {', '.join(unknown)}")
+
+    try:
+        args.concurrency = [int(c) for c in args.concurrency.split(",")]
+    except ValueError:
+        parser.error("--concurrency: ожидаются целые числа через запятую")
+    if any(c < 1 for c in args.concurrency):
+        parser.error("--concurrency: число клиентов должно быть положительным")
+    if args.duration <= 0 or args.warmup < 0:
+        parser.error("--duration должна быть положительной, --warmup неотрицательным")
+
+    external = {}
+    for item in args.url:
+        app, sep, url = item.partition("=")
+        if not sep or app not in MIXES:
+            parser.error(f"--url: ожидается APP=URL, получено {item!r}")
+        external[app] = url
+    args.url = external
+    return args
+
+
+def server_environment(app: str, cache: bool) -> tuple[dict, list]:
+    """
+    Переменные окружения запускаемого приложения и каталоги для удаления
+
+    Постоянный кэш lab2 (/tmp/lab2-cache) копится между запусками, и замер
+    постепенно превращается в замер поиска в кэше. Поэтому кэш либо
+    выключен, либо начинается пустым.
+    """
+    if app != "lab2":
+        return {}, []
+    if not cache:
+        return {"LAB2_CACHE_MEMORY_MB": "0", "LAB2_CACHE_DISK_MB": "0"}, []
+    cache_dir = tempfile.mkdtemp(prefix="lab2-cache-")
+    return {"LAB2_CACHE_DIR": cache_dir}, [cache_dir]
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    images = load_test_images(args.max_image_mb)
+    if args.logs:
+        os.makedirs(args.logs, exist_ok=True)
+
+    if ws_connect is None and "lab1" in args.apps:
+        print("Пакет websockets не установлен: lab1 нагружается только через HTTP", flush=True)
+    print(f"Изображений для загрузки: {len(images)}, "
+          f"замер {args.duration:g} с после прогрева {args.warmup:g} с на уровень", flush=True)
+
+    report = {"config": {k: v for k, v in vars(args).items() if k not in ("json", "logs")},
+              "results": {}}
+    for app in args.apps:
+        launch = app not in args.url
+        log_path = os.path.join(args.logs, f"{app}.log") if args.logs and launch else None
+        env, cleanup = server_environment(app, args.cache) if launch else ({}, [])
+        server = Server(app, args.url.get(app, DEFAULT_URLS[app]), launch, log_path, env, cleanup)
+        try:
+            server.start()
+            report["results"][app] = {"idle_rss_mb": server.rss() / 2**20 if launch else None,
+                                      "levels": []}
+            for concurrency in args.concurrency:
+                result = run_level(server, MIXES[app], images, concurrency,
+                                   args.duration, args.warmup, args.seed)
+                report["results"][app]["levels"].append(result)
+                print_level(app, result, args.verbose)
+        finally:
+            server.stop()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.json}")
+
+
+if __name__ == "__main__":
+    main()